@@ -1,12 +1,16 @@
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from polygon_cleaner import PolygonCleaner
+from tkinter import filedialog, messagebox, ttk
+
+# How often (ms) the Tk main loop drains the progress queue of the worker thread
+POLL_INTERVAL = 100
 
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("Google Earth Polygon Cleaner")
-        self.root.geometry("500x300")  # Set the window size
+        self.root.geometry("500x380")  # Set the window size
 
         # Create a frame for the controls
         self.frame = tk.Frame(root, bd=2, relief=tk.SUNKEN)
@@ -21,8 +25,20 @@ class App:
         self.file_label = tk.Label(self.frame, text="", wraplength=400)
         self.file_label.pack(pady=5)
 
-        self.run_button = tk.Button(self.frame, text="Run", command=self.run_cleaner, state=tk.DISABLED)
-        self.run_button.pack(pady=20)
+        self.buttons = tk.Frame(self.frame)
+        self.buttons.pack(pady=15)
+
+        self.run_button = tk.Button(self.buttons, text="Run", command=self.run_cleaner, state=tk.DISABLED)
+        self.run_button.pack(side=tk.LEFT, padx=5)
+
+        self.cancel_button = tk.Button(self.buttons, text="Cancel", command=self.cancel_cleaner, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        self.progress_bar = ttk.Progressbar(self.frame, length=400, mode='determinate')
+        self.progress_bar.pack(pady=5)
+
+        self.progress_label = tk.Label(self.frame, text="", wraplength=400)
+        self.progress_label.pack(pady=5)
 
         self.output_label = tk.Label(self.frame, text="", wraplength=400)
         self.output_label.pack(pady=5)
@@ -31,6 +47,9 @@ class App:
         self.footer_label.pack(side=tk.BOTTOM, anchor='se', padx=10, pady=10)
 
         self.file_path = None
+        # The cleaning run happens on a worker thread; it only talks to the UI through this queue
+        self.messages = queue.Queue()
+        self.cancel_event = None
 
     def browse_file(self):
         self.file_path = filedialog.askopenfilename(filetypes=[("KMZ files", "*.kmz")])
@@ -40,18 +59,89 @@ class App:
 
     def run_cleaner(self):
         if self.file_path:
-            try:
-                cleaner = PolygonCleaner(self.file_path)
-                cleaner.remove_duplicates()
-                cleaner.remove_pictures()
-                cleaner.save_cleaned_kmz()
-                cleaner.save_kml()
-                cleaner.cleanup()
-                output_path = cleaner.output_dir
-                self.output_label.config(text=f"Output saved to: {output_path}")
-                messagebox.showinfo("Success", "KMZ file cleaned successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {e}")
+            self.cancel_event = threading.Event()
+            self.select_button.config(state=tk.DISABLED)
+            self.run_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.NORMAL)
+            self.output_label.config(text="")
+            self.progress_bar.config(mode='indeterminate', value=0)
+            self.progress_bar.start()
+            self.progress_label.config(text="Loading KMZ file...")
+            worker = threading.Thread(target=self.clean_in_background,
+                                      args=(self.file_path, self.cancel_event), daemon=True)
+            worker.start()
+            self.root.after(POLL_INTERVAL, self.poll_messages)
+
+    def clean_in_background(self, file_path, cancel_event):
+        # Runs on the worker thread: never touch Tk widgets here, only put messages on the queue.
+        # The cleaner (lxml, NumPy) is imported here so the window shows up without waiting for it.
+        from polygon_cleaner import CleaningCancelled, PolygonCleaner
+
+        def progress(stage, scanned, total, duplicates):
+            self.messages.put(('progress', stage, scanned, total, duplicates))
+
+        try:
+            cleaner = PolygonCleaner(file_path, progress=progress, cancel_event=cancel_event)
+            cleaner.run()
+            self.messages.put(('done', cleaner.output_dir))
+        except CleaningCancelled:
+            self.messages.put(('cancelled',))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+    def cancel_cleaner(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_label.config(text="Cancelling...")
+
+    def poll_messages(self):
+        finished = False
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                if message[0] == 'progress':
+                    self.show_progress(*message[1:])
+                else:
+                    finished = True
+                    self.finish(message)
+        except queue.Empty:
+            pass
+        if not finished:
+            self.root.after(POLL_INTERVAL, self.poll_messages)
+
+    def show_progress(self, stage, scanned, total, duplicates):
+        if self.cancel_event.is_set():
+            return
+        if total:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=total, value=scanned)
+            text = f"{stage}: {scanned}/{total} placemarks scanned"
+        else:
+            if str(self.progress_bar['mode']) != 'indeterminate':
+                self.progress_bar.config(mode='indeterminate', value=0)
+                self.progress_bar.start()
+            text = f"{stage}: {scanned} placemarks scanned" if scanned else f"{stage}..."
+        if duplicates:
+            text += f", {duplicates} duplicates found"
+        self.progress_label.config(text=text)
+
+    def finish(self, message):
+        self.progress_bar.stop()
+        self.progress_bar.config(mode='determinate', value=0)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.select_button.config(state=tk.NORMAL)
+        self.run_button.config(state=tk.NORMAL)
+        self.cancel_event = None
+        if message[0] == 'done':
+            self.progress_label.config(text="")
+            self.output_label.config(text=f"Output saved to: {message[1]}")
+            messagebox.showinfo("Success", "KMZ file cleaned successfully!")
+        elif message[0] == 'cancelled':
+            self.progress_label.config(text="Cancelled, no output was written.")
+        else:
+            self.progress_label.config(text="")
+            messagebox.showerror("Error", f"An error occurred: {message[1]}")
 
 if __name__ == "__main__":
     root = tk.Tk()
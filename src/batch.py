@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def find_kmz_files(pattern):
+    """
+    Resolve a directory (searched recursively for .kmz files) or a glob pattern into a sorted list of KMZ paths.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*.kmz')
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def output_dirs(kmz_files, output_dir):
+    """
+    Map every input to its own output directory: output_dir plus the input's directory relative
+    to the directory common to all inputs, so files with the same name in different folders do
+    not overwrite each other's outputs. Raises ValueError when two inputs would still write the
+    same outputs (e.g. region.kmz and region.KMZ side by side).
+    """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(kmz_file)) for kmz_file in kmz_files])
+    targets = {}
+    claimed = {}  # output directory and base name -> input writing there
+    for kmz_file in kmz_files:
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(kmz_file)), root)
+        target = os.path.normpath(os.path.join(output_dir, relative))
+        key = os.path.normcase(os.path.join(target, os.path.splitext(os.path.basename(kmz_file))[0])).lower()
+        if key in claimed:
+            raise ValueError(f"{claimed[key]} and {kmz_file} would write the same outputs in {target}")
+        claimed[key] = kmz_file
+        targets[kmz_file] = target
+    return targets
+
+
+def clean_file(kmz_file, streaming=False, output_dir=None, use_cache=False):
+    """
+    Clean a single KMZ file in a worker process and return its summary row.
+    PolygonCleaner reads straight from the archive, so workers never share scratch space on disk.
+    """
+    from polygon_cleaner import PolygonCleaner
+
+    start = time.perf_counter()
+    result = {'input': kmz_file, 'duplicates_removed': 0, 'error': None}
+    try:
+        # Keep the per-stage banners of concurrent workers out of the console
+        with contextlib.redirect_stdout(io.StringIO()):
+            result.update(PolygonCleaner(kmz_file, streaming=streaming, output_dir=output_dir, use_cache=use_cache).run())
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+def clean_batch(kmz_files, workers=None, streaming=False, output_dir=None, use_cache=False):
+    """
+    Clean many KMZ files over a process pool of `workers` processes (default: one per core).
+    Every file writes into its own directory under output_dir (see output_dirs).
+    Returns one summary row per file, in input order.
+    """
+    output_dir = output_dir or os.path.join(os.path.expanduser('~'), 'PolygonCleanerOutput')
+    targets = output_dirs(kmz_files, output_dir)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(clean_file, kmz_file, streaming, targets[kmz_file], use_cache): kmz_file
+                   for kmz_file in kmz_files}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            status = 'ERROR' if result['error'] else 'ok'
+            print(f"[{len(results)}/{len(kmz_files)}] {status} {result['input']} ({result['wall_time']:.2f}s)")
+    return [results[kmz_file] for kmz_file in kmz_files]
+
+
+def write_summary(results, total_time, output_dir):
+    """
+    Write the combined batch summary to the output directory and return its path.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    summary_path = os.path.join(output_dir, f"BatchSummary_{timestamp}.txt")
+    failed = [result for result in results if result['error']]
+    with open(summary_path, 'w', encoding='utf-8') as summary_file:
+        summary_file.write("Batch Cleaning Summary\n======================\n\n")
+        summary_file.write(f"Generated at: {timestamp}\n")
+        summary_file.write(f"Files processed: {len(results) - len(failed)}\n")
+        summary_file.write(f"Files failed: {len(failed)}\n")
+        summary_file.write(f"Total duplicates removed: {sum(result['duplicates_removed'] for result in results)}\n")
+        summary_file.write(f"Total wall time: {total_time:.2f}s\n\n---\n")
+        for result in results:
+            summary_file.write(f"Input file: {result['input']}\n")
+            summary_file.write(f"Duplicates removed: {result['duplicates_removed']}\n")
+            summary_file.write(f"Wall time: {result['wall_time']:.2f}s\n")
+            if result['error']:
+                summary_file.write(f"Error: {result['error']}\n")
+            else:
+                summary_file.write(f"Output KMZ: {result['kmz']}\n")
+            summary_file.write("---\n")
+    return summary_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clean every KMZ file in a directory or matching a glob pattern in parallel.')
+    parser.add_argument('inputs', type=str, help='Directory or glob pattern (quote it) of the input KMZ files')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of cores)')
+    parser.add_argument('--streaming', action='store_true', help='Use the streaming deduplication mode in every worker')
+    parser.add_argument('--cache', action='store_true', help='Share the persistent fingerprint cache between runs and workers')
+    parser.add_argument('--output-dir', type=str, default=None, help='Output directory (default: ~/PolygonCleanerOutput)')
+    args = parser.parse_args()
+
+    kmz_files = find_kmz_files(args.inputs)
+    if not kmz_files:
+        print(f"No KMZ files found for {args.inputs}")
+        sys.exit(1)
+    output_dir = args.output_dir or os.path.join(os.path.expanduser('~'), 'PolygonCleanerOutput')
+
+    start = time.perf_counter()
+    try:
+        results = clean_batch(kmz_files, workers=args.workers, streaming=args.streaming, output_dir=output_dir,
+                              use_cache=args.cache)
+    except ValueError as e:
+        print(f"Output name clash: {e}")
+        sys.exit(1)
+    total_time = time.perf_counter() - start
+    summary_path = write_summary(results, total_time, output_dir)
+
+    failed = sum(1 for result in results if result['error'])
+    print(f"Files processed: {len(results) - failed} ({failed} failed)")
+    print(f"Total duplicates removed: {sum(result['duplicates_removed'] for result in results)}")
+    print(f"Total wall time: {total_time:.2f}s")
+    print(f"Summary written to: {summary_path}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,58 @@
+"""
+Microbenchmark: dedup key construction with normalize_coords versus the NumPy fingerprints.
+
+Run from the src directory:
+    python -m benchmarks.fingerprint_benchmark --vertices 10 1000 10000
+"""
+import argparse
+import random
+import timeit
+
+from utils.fingerprint import FingerprintIndex, geometry_digest, parse_coords, quantize
+from utils.kml_utils import normalize_coords
+
+
+def make_coords(vertices, seed=0):
+    # Google Earth style block: 15 decimals and an altitude component
+    rng = random.Random(seed)
+    lon, lat = rng.uniform(-80, -70), rng.uniform(-15, -5)
+    return ' '.join(f'{lon + rng.uniform(-0.01, 0.01):.15f},{lat + rng.uniform(-0.01, 0.01):.15f},0'
+                    for _ in range(vertices))
+
+
+def legacy_key(coords):
+    return ('Parcel', 'Polygon', normalize_coords(coords))
+
+
+def hashed_key(coords):
+    return geometry_digest('Parcel', 'Polygon', quantize(parse_coords(coords)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dedup key construction strategies.')
+    parser.add_argument('--vertices', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'vertices':>10} {'normalize_coords (ms)':>22} {'numpy digest (ms)':>18} {'speedup':>8}")
+    for vertices in args.vertices:
+        coords = make_coords(vertices)
+        number = max(1, 20000 // vertices)
+        legacy = min(timeit.repeat(lambda: legacy_key(coords), number=number, repeat=args.repeat)) / number
+        hashed = min(timeit.repeat(lambda: hashed_key(coords), number=number, repeat=args.repeat)) / number
+        print(f"{vertices:>10} {legacy * 1000:>22.3f} {hashed * 1000:>18.3f} {legacy / hashed:>7.1f}x")
+
+    # Sanity check: both strategies must agree on which keys are duplicates
+    blocks = [make_coords(50, seed=i % 200) for i in range(1000)]
+    legacy_seen, index = set(), FingerprintIndex()
+    legacy_dups = hashed_dups = 0
+    for position, coords in enumerate(blocks):
+        key = legacy_key(coords)
+        legacy_dups += key in legacy_seen
+        legacy_seen.add(key)
+        hashed_dups += index.add('Parcel', 'Polygon', coords, position) is not None
+    print(f"duplicates found: normalize_coords={legacy_dups} numpy digest={hashed_dups}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark the PolygonCleaner pipeline stage by stage on synthetic KMZ files and write the
+results as JSON, so runs can be compared and regressions caught.
+
+Run from the src directory:
+    python -m benchmarks.pipeline_benchmark --placemarks 1000 10000 --vertices 20
+    python -m benchmarks.pipeline_benchmark --baseline benchmark_old.json --threshold 0.2
+    python -m benchmarks.pipeline_benchmark --compact --incremental --compression stored deflated --compression-level 1 6 9
+
+Every case runs in a fresh worker process, so its peak memory is not inflated by earlier cases.
+"""
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic_kmz import generate_kmz
+from utils.profiling import peak_rss_mb
+
+STAGES = ['load', 'dedup', 'picture_removal', 'save_kmz', 'save_kml']
+# Modules the cleaner imports lazily inside its stages (NumPy, Shapely); imported before any
+# stage is timed, so their one-off import cost is not counted in dedup or the cleaner's metrics
+LAZY_MODULES = ['utils.fingerprint', 'utils.near_duplicates', 'utils.simplify']
+
+
+def run_case(case, repeat=1):
+    """
+    Generate the synthetic KMZ of one case and time every stage of the pipeline on it.
+    The fastest of `repeat` runs is kept for every stage. The import of the lazily loaded
+    modules is timed on its own as import_s, outside the stages and total_s.
+    """
+    from polygon_cleaner import PolygonCleaner
+
+    start = time.perf_counter()
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
+    import_s = time.perf_counter() - start
+
+    stages = {stage: {'wall_s': None, 'peak_rss_mb': None} for stage in STAGES}
+    with tempfile.TemporaryDirectory() as workdir:
+        kmz_file = generate_kmz(os.path.join(workdir, 'synthetic.kmz'), case['placemarks'], case['vertices'],
+                                case['duplicate_ratio'], case['folder_depth'], case['images'], case['seed'])
+        result = {'case': case, 'input_bytes': os.path.getsize(kmz_file), 'import_s': import_s}
+        for attempt in range(repeat):
+            output_dir = os.path.join(workdir, f'output_{attempt}')
+            timings = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                cleaner = PolygonCleaner(kmz_file, streaming=case['streaming'], output_dir=output_dir,
+                                         compact=case['compact'], compression=case['compression'],
+                                         compresslevel=case['compresslevel'], incremental=case['incremental'])
+                timings['load'] = time.perf_counter() - start
+                stages['load']['peak_rss_mb'] = peak_rss_mb()
+                try:
+                    for stage, step in [('dedup', cleaner.remove_duplicates),
+                                        ('picture_removal', cleaner.remove_pictures),
+                                        ('save_kmz', cleaner.save_cleaned_kmz),
+                                        ('save_kml', cleaner.save_kml)]:
+                        start = time.perf_counter()
+                        output = step()
+                        timings[stage] = time.perf_counter() - start
+                        if stage == 'dedup':
+                            result['duplicates_removed'] = output
+                        elif stage in ('save_kmz', 'save_kml'):
+                            result[f'{stage}_bytes'] = os.path.getsize(output)
+                        stages[stage]['peak_rss_mb'] = peak_rss_mb()
+                finally:
+                    cleaner.cleanup()
+            # Finer-grained records of the cleaner's own instrumentation (parse, dedup_scan, zip, ...)
+            result['metrics'] = cleaner.metrics
+            for stage, wall in timings.items():
+                best = stages[stage]['wall_s']
+                stages[stage]['wall_s'] = wall if best is None else min(best, wall)
+    result['stages'] = stages
+    result['total_s'] = sum(stage['wall_s'] for stage in stages.values())
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_cases(cases, repeat=1):
+    results = []
+    for case in cases:
+        # A fresh spawned process per case keeps its peak memory its own
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = pool.submit(run_case, case, repeat).result()
+        results.append(result)
+        stage_times = ' '.join(f"{stage}={result['stages'][stage]['wall_s']:.3f}s" for stage in STAGES)
+        print(f"{case_label(case)}: total={result['total_s']:.3f}s {stage_times} "
+              f"peak={result['peak_rss_mb'] or 0:.0f} MB kmz={result['save_kmz_bytes'] / 1024:.0f} KB "
+              f"kml={result['save_kml_bytes'] / 1024:.0f} KB import={result['import_s']:.3f}s")
+    return results
+
+
+def case_label(case):
+    level = '' if case['compresslevel'] is None else f"-{case['compresslevel']}"
+    return (f"placemarks={case['placemarks']} vertices={case['vertices']} duplicates={case['duplicate_ratio']} "
+            f"depth={case['folder_depth']} images={case['images']}{' streaming' if case['streaming'] else ''} "
+            f"{'compact' if case['compact'] else 'pretty'} {case['compression']}{level}"
+            f"{' incremental' if case['incremental'] else ''}")
+
+
+def find_regressions(results, baseline, threshold, min_delta=0.01):
+    """
+    Compare every stage time (and peak memory) with the matching case of a previous run and
+    return a list of messages for the ones that got slower or bigger by more than threshold.
+    Stages that got slower by less than min_delta seconds are timer noise and are ignored.
+    """
+    previous = {json.dumps(result['case'], sort_keys=True): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(json.dumps(result['case'], sort_keys=True))
+        if old is None:
+            continue
+        for stage in STAGES:
+            new_time, old_time = result['stages'][stage]['wall_s'], old['stages'][stage]['wall_s']
+            if old_time and new_time > old_time * (1 + threshold) and new_time - old_time >= min_delta:
+                regressions.append(f"{case_label(result['case'])}: {stage} {old_time:.3f}s -> {new_time:.3f}s")
+        if old.get('peak_rss_mb') and result['peak_rss_mb'] and \
+                result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{case_label(result['case'])}: peak memory "
+                               f"{old['peak_rss_mb']:.0f} MB -> {result['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every PolygonCleaner stage on synthetic KMZ files.')
+    parser.add_argument('--placemarks', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--vertices', type=int, nargs='+', default=[20])
+    parser.add_argument('--duplicate-ratio', type=float, nargs='+', default=[0.2])
+    parser.add_argument('--folder-depth', type=int, nargs='+', default=[2])
+    parser.add_argument('--images', type=int, nargs='+', default=[5])
+    parser.add_argument('--streaming', action='store_true', help='Also run every case in streaming mode')
+    parser.add_argument('--compact', action='store_true', help='Also run every case with compact output')
+    parser.add_argument('--incremental', action='store_true', help='Also run every in-memory case with the incremental writer')
+    parser.add_argument('--compression', choices=['stored', 'deflated'], nargs='+', default=['deflated'])
+    parser.add_argument('--compression-level', type=int, nargs='+', default=[None], help='Deflate levels to compare')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='Keep the fastest of this many runs per stage')
+    parser.add_argument('--output', type=str, default=None, help='JSON results file (default: benchmark_<timestamp>.json)')
+    parser.add_argument('--baseline', type=str, default=None, help='Previous JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    parser.add_argument('--min-delta', type=float, default=0.01, help='Ignore slowdowns below this many seconds')
+    args = parser.parse_args()
+
+    modes = [False, True] if args.streaming else [False]
+    layouts = [False, True] if args.compact else [False]
+    writers = [False, True] if args.incremental else [False]
+    # Stored members have no level, and streaming always writes incrementally
+    outputs = [(compression, level) for compression in args.compression
+               for level in (args.compression_level if compression == 'deflated' else [None])]
+    cases = [{'placemarks': placemarks, 'vertices': vertices, 'duplicate_ratio': duplicate_ratio,
+              'folder_depth': folder_depth, 'images': images, 'seed': args.seed, 'streaming': streaming,
+              'compact': compact, 'compression': compression, 'compresslevel': level, 'incremental': incremental}
+             for placemarks, vertices, duplicate_ratio, folder_depth, images, streaming, compact, (compression, level),
+             incremental in itertools.product(args.placemarks, args.vertices, args.duplicate_ratio, args.folder_depth,
+                                              args.images, modes, layouts, outputs, writers)
+             if not (streaming and incremental)]
+    results = run_cases(cases, args.repeat)
+
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    output = args.output or f'benchmark_{timestamp}.json'
+    with open(output, 'w', encoding='utf-8') as results_file:
+        json.dump({'generated_at': timestamp, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'results': results}, results_file, indent=2)
+    print(f"Results written to: {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.threshold, args.min_delta)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
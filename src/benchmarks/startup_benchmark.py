@@ -0,0 +1,137 @@
+"""
+Measure the import cost of the CLI and GUI entry points with `python -X importtime` and check
+it against a per-entry-point budget, so slow top-level imports are caught when they creep in.
+
+Run from the src directory:
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --repeat 10 --budget cli=120 gui=60 --output startup.json
+
+Exits with status 1 when an entry point goes over its budget or imports a module it must not.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each entry point imports before it starts working: the CLI up to the first cleaning
+# stage of `main.py <file>`, the GUI up to the window of `main.py` without arguments
+ENTRY_POINTS = {
+    'cli': 'import main; from polygon_cleaner import PolygonCleaner',
+    'gui': 'import main, tkinter, app',
+}
+# Modules an entry point must never import; the CLI has to work on headless machines
+FORBIDDEN_MODULES = {
+    'cli': ['tkinter', '_tkinter'],
+}
+# Import time budgets in milliseconds, with headroom over the times measured on a laptop
+DEFAULT_BUDGETS_MS = {
+    'cli': 150,
+    'gui': 60,
+}
+
+
+def parse_importtime(stderr):
+    """
+    Return {module: (self_us, cumulative_us, depth)} from the `-X importtime` lines of stderr;
+    depth 0 is a module imported by the measured code itself.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # The name is indented by two spaces per nesting level after one separating space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def measure(code):
+    """
+    Import code in a fresh interpreter and return (total import ms, process wall ms, modules).
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=SRC_DIR,
+                               capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    modules = parse_importtime(completed.stderr)
+    return sum(self_us for self_us, _, _ in modules.values()) / 1000, wall_ms, modules
+
+
+def run_entry_point(name, repeat=5, top=10):
+    """
+    Measure one entry point `repeat` times and keep the fastest run (the others carry disk cache
+    and scheduling noise). Returns its result dict.
+    """
+    runs = [measure(ENTRY_POINTS[name]) for _ in range(repeat)]
+    import_ms, wall_ms, modules = min(runs, key=lambda run: run[0])
+    # Heaviest imports made by the entry point itself, with everything they pulled in
+    heaviest = sorted(((module, cumulative / 1000) for module, (_, cumulative, depth) in modules.items() if depth == 0),
+                      key=lambda item: -item[1])[:top]
+    forbidden = [module for module in FORBIDDEN_MODULES.get(name, []) if module in modules]
+    return {
+        'entry_point': name,
+        'import_ms': import_ms,
+        'wall_ms': min(run[1] for run in runs),
+        'modules': len(modules),
+        'heaviest': heaviest,
+        'forbidden_imports': forbidden,
+    }
+
+
+def check_budgets(results, budgets):
+    """
+    Return a list of messages for the entry points over their budget or importing forbidden modules.
+    """
+    failures = []
+    for result in results:
+        budget = budgets.get(result['entry_point'])
+        if budget is not None and result['import_ms'] > budget:
+            failures.append(f"{result['entry_point']}: imports take {result['import_ms']:.1f} ms, budget {budget} ms")
+        for module in result['forbidden_imports']:
+            failures.append(f"{result['entry_point']}: imports {module}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the CLI and GUI entry points.')
+    parser.add_argument('entry_points', nargs='*', default=list(ENTRY_POINTS),
+                        help=f"Entry points to measure (default: {' '.join(ENTRY_POINTS)})")
+    parser.add_argument('--repeat', type=int, default=5, help='Keep the fastest of this many runs')
+    parser.add_argument('--budget', nargs='+', default=[], metavar='NAME=MS', help='Override a budget, e.g. cli=120')
+    parser.add_argument('--output', type=str, default=None, help='Also write the results as JSON')
+    args = parser.parse_args()
+    unknown = set(args.entry_points) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f"unknown entry points: {' '.join(sorted(unknown))}")
+
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for budget in args.budget:
+        name, ms = budget.split('=')
+        budgets[name] = float(ms)
+
+    results = []
+    for name in args.entry_points:
+        result = run_entry_point(name, args.repeat)
+        results.append(result)
+        heaviest = ', '.join(f"{module} {ms:.1f}" for module, ms in result['heaviest'][:5])
+        print(f"{name}: imports={result['import_ms']:.1f} ms (budget {budgets.get(name)} ms) "
+              f"process={result['wall_ms']:.1f} ms modules={result['modules']} heaviest: {heaviest}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as results_file:
+            json.dump({'python': sys.version, 'budgets_ms': budgets, 'results': results}, results_file, indent=2)
+
+    failures = check_budgets(results, budgets)
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if failures:
+        sys.exit(1)
+    print("All entry points within budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Deterministic synthetic KMZ generator for the benchmarks.
+
+Run from the src directory:
+    python -m benchmarks.synthetic_kmz out.kmz --placemarks 10000 --vertices 50 --duplicate-ratio 0.2
+"""
+import argparse
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+KML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+              '<Document>\n\t<name>Synthetic benchmark</name>\n')
+KML_FOOTER = '</Document>\n</kml>\n'
+IMAGE_SIZE = 16 * 1024
+
+
+def _polygon(rng, vertices):
+    # Closed ring around a random center, written like Google Earth does (15 decimals, altitude)
+    lon, lat = rng.uniform(-80, -70), rng.uniform(-15, -5)
+    ring = [(lon + rng.uniform(-0.01, 0.01), lat + rng.uniform(-0.01, 0.01)) for _ in range(max(vertices, 3))]
+    ring.append(ring[0])
+    return ' '.join(f'{x:.15f},{y:.15f},0' for x, y in ring)
+
+
+def _placemark(name, coords, image, indent):
+    description = f'<description><![CDATA[<img src="{image}">]]></description>' if image else ''
+    return (f'{indent}<Placemark><name>{escape(name)}</name>{description}'
+            f'<Polygon><outerBoundaryIs><LinearRing><coordinates>{coords}</coordinates>'
+            f'</LinearRing></outerBoundaryIs></Polygon></Placemark>\n')
+
+
+def _leaf_paths(folder_depth, branching):
+    # Every leaf folder as a tuple of child indexes, in document order
+    paths = [()]
+    for _ in range(folder_depth):
+        paths = [path + (i,) for path in paths for i in range(branching)]
+    return paths
+
+
+def generate_kml(placemarks=1000, vertices=20, duplicate_ratio=0.2, folder_depth=2, images=5, seed=0,
+                 branching=2):
+    """
+    Return a KML document as a string. About duplicate_ratio of the placemarks are exact copies
+    (same name and coordinates) of an earlier placemark, possibly in another folder. Placemarks are
+    spread over branching ** folder_depth leaf folders nested folder_depth levels deep, and every
+    image gets a GroundOverlay and is referenced from placemark descriptions.
+    """
+    rng = random.Random(seed)
+    image_names = [f'files/image_{i}.jpg' for i in range(images)]
+    leaves = _leaf_paths(folder_depth, branching)
+    per_leaf = [[] for _ in leaves]
+    originals = []
+    for i in range(placemarks):
+        if originals and rng.random() < duplicate_ratio:
+            name, coords = rng.choice(originals)
+        else:
+            name, coords = f'Parcel {i}', _polygon(rng, vertices)
+            originals.append((name, coords))
+        per_leaf[i % len(leaves)].append((name, coords, image_names[i % images] if images else None))
+
+    parts = [KML_HEADER]
+    for i, image in enumerate(image_names):
+        parts.append(f'\t<GroundOverlay><name>Overlay {i}</name><Icon><href>{image}</href></Icon>'
+                     f'<LatLonBox><north>-5</north><south>-15</south><east>-70</east><west>-80</west></LatLonBox>'
+                     f'</GroundOverlay>\n')
+    previous = ()
+    for leaf, members in zip(leaves, per_leaf):
+        # Close the folders of the previous leaf that are not shared and open the new ones
+        shared = 0
+        while shared < len(previous) and previous[shared] == leaf[shared]:
+            shared += 1
+        for level in range(len(previous), shared, -1):
+            parts.append('\t' * level + '</Folder>\n')
+        for level in range(shared, len(leaf)):
+            parts.append('\t' * (level + 1) + f'<Folder><name>Folder {"-".join(map(str, leaf[:level + 1]))}</name>\n')
+        indent = '\t' * (len(leaf) + 1)
+        parts.extend(_placemark(name, coords, image, indent) for name, coords, image in members)
+        previous = leaf
+    for level in range(len(previous), 0, -1):
+        parts.append('\t' * level + '</Folder>\n')
+    parts.append(KML_FOOTER)
+    return ''.join(parts)
+
+
+def generate_kmz(path, placemarks=1000, vertices=20, duplicate_ratio=0.2, folder_depth=2, images=5, seed=0):
+    """
+    Write a synthetic KMZ (doc.kml plus the embedded images) to path and return path.
+    The same arguments always produce the same archive contents.
+    """
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr('doc.kml', generate_kml(placemarks, vertices, duplicate_ratio, folder_depth, images, seed))
+        for i in range(images):
+            kmz.writestr(f'files/image_{i}.jpg', rng.randbytes(IMAGE_SIZE))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a deterministic synthetic KMZ file.')
+    parser.add_argument('output', type=str, help='Path of the KMZ file to write')
+    parser.add_argument('--placemarks', type=int, default=1000)
+    parser.add_argument('--vertices', type=int, default=20, help='Vertices per polygon')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2)
+    parser.add_argument('--folder-depth', type=int, default=2)
+    parser.add_argument('--images', type=int, default=5, help='Number of embedded images')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_kmz(args.output, args.placemarks, args.vertices, args.duplicate_ratio, args.folder_depth,
+                 args.images, args.seed)
+    print(f"Synthetic KMZ written to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,65 @@
-from app import App
-import tkinter as tk
+def non_negative(convert):
+    # argparse type: convert the value, rejecting anything below 0 like the service API does
+    def parse(value):
+        import argparse
+        try:
+            number = convert(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid {convert.__name__} value: {value!r}")
+        if not number >= 0:
+            raise argparse.ArgumentTypeError(f"must be 0 or more, not {value}")
+        return number
+    return parse
+
 
 def main():
+    # The command line stays headless: Tk and the GUI are only imported when no file is given,
+    # and the cleaner only once the arguments are parsed, so --help answers right away
     import argparse
-    from polygon_cleaner import PolygonCleaner
+    from utils.profiling import STAGES
 
     parser = argparse.ArgumentParser(description='Clean duplicate polygons and remove outdated picture references from KMZ files.')
     parser.add_argument('input_file', type=str, help='Path to the input KMZ file')
+    parser.add_argument('--streaming', action='store_true', help='Stream the KML with iterparse instead of loading it in memory (for files larger than RAM)')
+    parser.add_argument('--cache', action='store_true', help='Reuse geometry fingerprints from previous runs (kept in ~/PolygonCleanerCache.sqlite)')
+    parser.add_argument('--cache-size', type=int, default=None, metavar='ENTRIES', help='Maximum number of placemarks kept in the fingerprint cache (least recently used are evicted)')
+    parser.add_argument('--clear-cache', action='store_true', help='Invalidate the fingerprint cache before cleaning')
+    parser.add_argument('--workers', type=int, default=None, help='Deduplicate with this many worker processes (for very large documents)')
+    parser.add_argument('--metrics', choices=['json', 'csv'], default=None, help='Write per-stage timing, memory and count metrics next to the output')
+    parser.add_argument('--folder-report', choices=['json', 'csv'], default=None, help='Write the number of duplicates removed per folder path next to the output')
+    parser.add_argument('--profile-stage', choices=STAGES, default=None, help='Run this stage under cProfile and dump the stats next to the output')
+    parser.add_argument('--compact', action='store_true', help='Write the KML without indentation (smaller output)')
+    parser.add_argument('--compression', choices=['stored', 'deflated'], default='deflated', help='Compression of the KML inside the output KMZ')
+    parser.add_argument('--compression-level', type=int, choices=range(10), default=None, metavar='0-9', help='Deflate level (default: 6)')
+    parser.add_argument('--incremental', action='store_true', help='Write the cleaned document piece by piece instead of building it in memory first')
+    parser.add_argument('--oversized-asset', type=float, metavar='MB', default=None, help='List the archive members kept that are larger than this in the assets report (default: 1 MB)')
+    parser.add_argument('--near-duplicates', type=non_negative(float), metavar='METERS', default=None, help='Also remove re-digitized Polygon/LineString copies within this tolerance in meters')
+    parser.add_argument('--precision', type=non_negative(int), metavar='DECIMALS', default=None, help='Round coordinates to this many decimals (6 is about 11 cm)')
+    parser.add_argument('--simplify', type=non_negative(float), metavar='METERS', default=None, help='Simplify polygons and lines with Douglas-Peucker at this tolerance in meters')
 
     args = parser.parse_args()
 
-    cleaner = PolygonCleaner(args.input_file)
-    cleaner.remove_duplicates()
-    cleaner.remove_pictures()
-    cleaner.save_cleaned_kmz()
-    cleaner.save_kml()
-    cleaner.cleanup()
+    from polygon_cleaner import PolygonCleaner
+    cleaner = PolygonCleaner(args.input_file, streaming=args.streaming, use_cache=args.cache, cache_size=args.cache_size,
+                             metrics_format=args.metrics, profile_stage=args.profile_stage,
+                             workers=args.workers, compact=args.compact, compression=args.compression,
+                             compresslevel=args.compression_level, incremental=args.incremental,
+                             folder_report_format=args.folder_report,
+                             oversized_asset_bytes=int(args.oversized_asset * 1024 * 1024) if args.oversized_asset else None)
+    if args.clear_cache:
+        cleaner.clear_cache()
+    cleaner.run(near_duplicate_tolerance=args.near_duplicates, precision=args.precision,
+                simplify_tolerance=args.simplify)
 
 if __name__ == '__main__':
+    import multiprocessing
     import sys
+    multiprocessing.freeze_support()
     if len(sys.argv) > 1:
         main()
     else:
+        import tkinter as tk
+        from app import App
         root = tk.Tk()
         app = App(root)
         root.mainloop()
\ No newline at end of file
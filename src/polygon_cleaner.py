@@ -3,14 +3,111 @@ import os
 import shutil
 from lxml import etree as ET
 import sys
+import collections
+import csv
 import datetime
+import io
+import itertools
+import json
+import tempfile
+import threading
+from utils.kml_stream import (LateFolderName, iter_placemarks, read_folder_names, rewrite_kml, strip_blank_text,
+                               write_tree)
+from utils.kmz_io import find_kml_name, write_kmz
+from utils.placemark_index import PlacemarkIndex
+from utils.profiling import StageProfiler
+from utils.kml_utils import (COORDINATES_TAG, PLACEMARK_TAG, format_folder_path, get_name, iter_geometry_coords,
+                             iter_placemark_paths, normalize_coords)
+
+# Progress is reported every PROGRESS_EVERY placemarks, not for each one
+PROGRESS_EVERY = 500
+# Number of <coordinates> blocks simplified together
+SIMPLIFY_BATCH = 1000
+
+
+class CleaningCancelled(Exception):
+    """
+    Raised inside a cleaning run once its cancel event is set.
+    """
+
 
 class PolygonCleaner:
-    def __init__(self, kmz_file):
+    def __init__(self, kmz_file, streaming=False, output_dir=None, use_cache=False, cache_size=None,
+                 progress=None, cancel_event=None, metrics_format=None, profile_stage=None, workers=None,
+                 compact=False, compression='deflated', compresslevel=None, incremental=False,
+                 folder_report_format=None, oversized_asset_bytes=None):
         self.kmz_file = kmz_file
-        self.temp_dir = os.path.join(self.get_writable_path(), 'temp_kmz')
-        self.output_dir = os.path.join(self.get_writable_path(), 'PolygonCleanerOutput')
-        self.polygons = self.load_polygons()
+        # streaming=True never loads the whole KML: passes stream the document out of the
+        # archive with iterparse and the removals are applied while writing the outputs
+        self.streaming = streaming
+        # workers > 1 fingerprints the placemarks of the document in that many worker processes
+        # (see utils/parallel_dedup.py); the result is the same as the serial scan
+        self.workers = workers
+        self.output_dir = output_dir or os.path.join(self.get_writable_path(), 'PolygonCleanerOutput')
+        # use_cache=True keeps the geometry fingerprints of every placemark in an on-disk cache
+        # shared across runs, so unchanged placemarks skip coordinate parsing next time
+        self.use_cache = use_cache
+        self.cache_size = cache_size
+        self.cache_path = os.path.join(self.get_writable_path(), 'PolygonCleanerCache.sqlite')
+        self._cache = None
+        # progress(stage, scanned, total, duplicates) is called from the thread running the
+        # cleaner; total is None when unknown (streaming). Setting cancel_event stops the run
+        # between placemarks and run() then deletes every output it had already written.
+        self.progress = progress
+        self.cancel_event = cancel_event or threading.Event()
+        self._outputs = []
+        # Every stage is timed into self.profiler (see utils/profiling.py); with metrics_format
+        # ('json' or 'csv') run() writes the records next to the outputs, and with profile_stage
+        # that stage also runs under cProfile and the stats are dumped next to them
+        self.metrics_format = metrics_format
+        self.profiler = StageProfiler(profile_stage)
+        self.metrics_path = None
+        self.profile_path = None
+        # Output settings: compact=True leaves the indentation out of the written KML, the KML
+        # member of the KMZ is compressed with compression ('stored' or 'deflated', see
+        # utils/kmz_io.py) at compresslevel, and incremental=True writes the in-memory document
+        # piece by piece into the outputs instead of serializing it into one byte string first
+        self.compact = compact
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.incremental = incremental
+        # The dedup report counts the removed duplicates by their folder path
+        # (e.g. 'Region/District/Lot'); with folder_report_format ('json' or 'csv') run() also
+        # writes the counts per folder as a sidecar
+        self.folder_report_format = folder_report_format
+        self.duplicates_by_folder = collections.Counter()
+        self.folder_report_path = None
+        # The KMZ output only carries the members the cleaned document still links to (see
+        # utils/assets.py); the others and those over oversized_asset_bytes are listed in the
+        # assets report
+        self.oversized_asset_bytes = oversized_asset_bytes
+        self._assets = None
+        self.assets_removed = 0
+        self.assets_report_path = None
+        # The KML document is parsed once into self.tree; every pass mutates it
+        # in place and it is serialized once when the outputs are written.
+        self.tree = None
+        self.kml_name = None
+        self._kml_bytes = None
+        # The KMZ is read straight from the archive; nothing is extracted to disk
+        self.archive = None
+        self._dropped_placemarks = set()
+        self._dropped_tags = set()
+        # {Folder index: name} for streaming passes over a document that names Folders after some
+        # of their placemarks ({} once a pass found none; see iter_placemarks)
+        self._folder_names = None
+        # (precision, tolerance_m) of the coordinate rewrite, applied while writing in streaming mode
+        self._simplify = None
+        self._saved_kmz = None
+        self._index = None
+        self.duplicates_removed = 0
+        self.report_path = None
+        self.near_report_path = None
+        try:
+            self.polygons = self.load_polygons()
+        except Exception:
+            self.cleanup()
+            raise
 
     def get_writable_path(self):
         if getattr(sys, 'frozen', False):
@@ -21,158 +118,624 @@ class PolygonCleaner:
         else:
             return os.path.expanduser('~')
 
+    @property
+    def metrics(self):
+        """
+        Per-stage records (wall_s, cpu_s, peak_rss_mb, rss_growth_mb and counts) of this cleaner so far.
+        """
+        return self.profiler.records
+
     def load_polygons(self):
-        # Create the temporary directory if it does not exist
-        if not os.path.exists(self.temp_dir):
-            os.makedirs(self.temp_dir)
-        
-        with zipfile.ZipFile(self.kmz_file, 'r') as kmz:
-            kmz.extractall(self.temp_dir)
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        tree = ET.parse(os.path.join(self.temp_dir, kml_file))
-        root = tree.getroot()
-        namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
-        placemarks = root.findall('.//kml:Placemark', namespaces)
-        polygons = []
-        geometry_types = ['Polygon', 'LineString', 'MultiGeometry', 'LinearRing', 'Point']
-        for placemark in placemarks:
-            for geom_type in geometry_types:
-                geometry = placemark.find(f'.//kml:{geom_type}', namespaces)
-                if geometry is not None:
-                    polygons.append((placemark, geometry))
-                    break  # Only add the first found geometry type per placemark
+        with self.profiler.stage('extract') as counts:
+            self.archive = zipfile.ZipFile(self.kmz_file, 'r')
+            self.kml_name = find_kml_name(self.archive)
+            kml_info = self.archive.getinfo(self.kml_name)
+            counts['compressed_bytes'] = kml_info.compress_size
+            counts['bytes'] = kml_info.file_size
+        if self.streaming:
+            return []
+        with self.profiler.stage('parse') as counts:
+            with self.archive.open(self.kml_name) as kml:
+                self.tree = ET.parse(kml)
+            self._kml_bytes = None
+            root = self.tree.getroot()
+            namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
+            placemarks = root.findall('.//kml:Placemark', namespaces)
+            polygons = []
+            geometry_types = ['Polygon', 'LineString', 'MultiGeometry', 'LinearRing', 'Point']
+            for placemark in placemarks:
+                for geom_type in geometry_types:
+                    geometry = placemark.find(f'.//kml:{geom_type}', namespaces)
+                    if geometry is not None:
+                        polygons.append((placemark, geometry))
+                        break  # Only add the first found geometry type per placemark
+            counts['bytes'] = kml_info.file_size
+            counts['placemarks'] = len(placemarks)
         return polygons
 
+    def serialize_kml(self):
+        """
+        Return the in-memory KML document as bytes.
+        The result is cached until the next cleaning pass mutates the tree, so writing
+        both the KMZ and the KML output costs a single serialization.
+        """
+        if self._kml_bytes is None:
+            if self.compact:
+                strip_blank_text(self.tree.getroot())
+            self._kml_bytes = ET.tostring(self.tree, pretty_print=not self.compact)
+        return self._kml_bytes
+
+    def _write_tree(self, destination):
+        # Incremental counterpart of serialize_kml; the tree keeps the indentation of the input
+        # document, so it is written as it is rather than pretty-printed again
+        if self.compact:
+            strip_blank_text(self.tree.getroot())
+        write_tree(self.tree, destination)
+
+    def _document_changed(self):
+        # A cleaning pass removed content: drop everything derived from the previous state
+        self._kml_bytes = None
+        self._saved_kmz = None
+        self._index = None
+
+    def get_root(self):
+        """
+        Return the root of the KML document; in streaming mode the cleaned document is
+        streamed into memory on demand for the search and report helpers.
+        """
+        if self.tree is None:
+            cleaned = io.BytesIO()
+            self._write_streamed_kml(cleaned)
+            return ET.fromstring(cleaned.getvalue())
+        return self.tree.getroot()
+
+    def _streaming_drop(self):
+        # Fresh predicate for one streaming rewrite of the original document: Placemarks are
+        # dropped by their position in the document, other elements by tag
+        positions = itertools.count()
+
+        def should_drop(elem):
+            if elem.tag == PLACEMARK_TAG:
+                self._check_cancelled()
+                return next(positions) in self._dropped_placemarks
+            if elem.tag == COORDINATES_TAG and self._simplify is not None:
+                # The coordinates are rewritten in place before their placemark is written out
+                self._simplify_element(elem)
+            return elem.tag in self._dropped_tags
+
+        return should_drop
+
+    def _write_streamed_kml(self, destination, on_write=None):
+        with self.archive.open(self.kml_name) as source:
+            rewrite_kml(source, destination, self._streaming_drop(), compact=self.compact, on_write=on_write)
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise CleaningCancelled(self.kmz_file)
+
+    def _report_progress(self, stage, scanned=0, total=None, duplicates=0):
+        if self.progress is not None:
+            self.progress(stage, scanned, total, duplicates)
+
+    def _track_output(self, path):
+        # Remember every file a run writes so a cancelled run can remove them again
+        self._outputs.append(path)
+        return path
+
+    def _remove_outputs(self):
+        for path in self._outputs:
+            if os.path.exists(path):
+                os.remove(path)
+        self._outputs = []
+
+    def run(self, near_duplicate_tolerance=None, precision=None, simplify_tolerance=None):
+        """
+        Run the full cleaning pipeline against the single in-memory tree:
+        deduplicate, drop picture overlays, write the KMZ and KML outputs and clean up.
+        With near_duplicate_tolerance (meters) the near-duplicate pass runs after deduplication.
+        With precision (decimals) or simplify_tolerance (meters) the coordinates are then
+        rewritten by simplify_geometries.
+        Returns a dict with the output paths and the number of duplicates removed.
+        Raises CleaningCancelled, with no output left behind, when cancel_event is set.
+        """
+        near_duplicates_removed = 0
+        vertices_before = vertices_after = None
+        try:
+            self._check_cancelled()
+            duplicates_removed = self.remove_duplicates()
+            if near_duplicate_tolerance is not None:
+                near_duplicates_removed = self.remove_near_duplicates(near_duplicate_tolerance)
+            if precision is not None or simplify_tolerance is not None:
+                vertices_before, vertices_after = self.simplify_geometries(precision, simplify_tolerance)
+            self._report_progress('Removing pictures')
+            self.remove_pictures()
+            self._check_cancelled()
+            self._report_progress('Writing KMZ')
+            kmz_path = self.save_cleaned_kmz()
+            self._check_cancelled()
+            self._report_progress('Writing KML')
+            kml_path = self.save_kml()
+            if self.profiler.profile_stage:
+                self.profile_path = self._track_output(self.profiler.dump_profile(
+                    self._sidecar_path('Profile', f'_{self.profiler.profile_stage}.prof')))
+            if self.folder_report_format:
+                self.write_folder_report()
+            if self.metrics_format:
+                self.write_metrics()
+            self._report_progress('Done', duplicates=duplicates_removed + near_duplicates_removed)
+        except CleaningCancelled:
+            self._remove_outputs()
+            raise
+        finally:
+            self.cleanup()
+        return {
+            'input': self.kmz_file,
+            'kmz': kmz_path,
+            'kml': kml_path,
+            'report': self.report_path,
+            'duplicates_removed': duplicates_removed,
+            'near_duplicates_removed': near_duplicates_removed,
+            'near_duplicates_report': self.near_report_path,
+            'folder_report': self.folder_report_path,
+            'assets_removed': self.assets_removed,
+            'assets_report': self.assets_report_path,
+            'vertices_before': vertices_before,
+            'vertices_after': vertices_after,
+            'metrics': self.metrics_path,
+            'profile': self.profile_path,
+        }
+
+    def _sidecar_path(self, prefix, suffix):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        base_name = os.path.splitext(os.path.basename(self.kmz_file))[0]
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(self.output_dir, f"{prefix}_{base_name}_{timestamp}{suffix}")
+
+    def write_metrics(self, metrics_format=None):
+        """
+        Write the per-stage metrics as a JSON or CSV sidecar in the output directory and return its path.
+        """
+        metrics_format = metrics_format or self.metrics_format or 'json'
+        path = self._track_output(self._sidecar_path('Metrics', f'.{metrics_format}'))
+        if metrics_format == 'csv':
+            self.profiler.write_csv(path)
+        else:
+            self.profiler.write_json(path)
+        self.metrics_path = path
+        return path
+
+    def write_folder_report(self, folder_report_format=None):
+        """
+        Write the number of duplicates removed per folder path, most duplicates first, as a JSON
+        or CSV sidecar in the output directory and return its path. Placemarks outside any named
+        Folder are counted under the empty path.
+        """
+        folder_report_format = folder_report_format or self.folder_report_format or 'json'
+        path = self._track_output(self._sidecar_path('DuplicatesByFolder', f'.{folder_report_format}'))
+        rows = [{'folder_path': folder_path, 'duplicates': count} for folder_path, count in self._folder_counts()]
+        if folder_report_format == 'csv':
+            with open(path, 'w', encoding='utf-8', newline='') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=['folder_path', 'duplicates'])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(path, 'w', encoding='utf-8') as report_file:
+                json.dump({'input': os.path.basename(self.kmz_file), 'duplicates_removed': self.duplicates_removed,
+                           'folders': rows}, report_file, indent=2)
+        self.folder_report_path = path
+        return path
+
+    def _folder_counts(self):
+        # (folder path, duplicates) pairs, most duplicates first and by path for equal counts
+        return sorted(self.duplicates_by_folder.items(), key=lambda item: (-item[1], item[0]))
+
     def remove_duplicates(self):
         """
         Remove duplicate polygons from the KML tree globally, even if they are in different folders/subfolders or under different parent structures.
         Keep only the last found polygon for each unique (name, coordinates) pair.
         Print debug info about which polygons are removed.
+        In streaming mode the document is streamed out of the archive in two iterparse passes instead.
         """
         print("\n========== GLOBAL POLYGON DEDUPLICATION (BY NAME + COORDS) ==========")
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        tree = ET.parse(os.path.join(self.temp_dir, kml_file))
-        root = tree.getroot()
-        namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
-        key_to_placemark = {}
-        placemarks = []
-        san_roque_debug = []  # Collect debug info for SAN ROQUE only
-        def normalize_coords(coords_str):
-            coord_lines = [line.strip() for line in coords_str.strip().split() if line.strip()]
-            norm_coords = []
-            for line in coord_lines:
-                parts = line.split(",")
-                if len(parts) >= 2:
-                    try:
-                        lon = round(float(parts[0]), 6)
-                        lat = round(float(parts[1]), 6)
-                        norm_coords.append((lon, lat))
-                    except Exception:
-                        continue
-            return tuple(norm_coords)
-
-        def get_name(elem):
-            # Try direct child with and without namespace
-            name_elem = elem.find('{http://www.opengis.net/kml/2.2}name') or elem.find('name')
-            if name_elem is not None and name_elem.text:
-                return name_elem.text.strip()
-            # Try any descendant <name> (with or without namespace)
-            for child in elem.iter():
-                if child.tag.endswith('name') and child.text:
-                    return child.text.strip()
-            return None
-
-        def find_first_child_by_tag(elem, tag_suffix):
-            # Find first child (any depth) whose tag ends with tag_suffix (e.g., 'Polygon', 'coordinates')
-            for child in elem.iter():
-                if child.tag.endswith(tag_suffix):
-                    return child
-            return None
-
-        # Build a dict to track the last occurrence of each (name, geometry type, normalized coords)
-        last_occurrence = {}
-        placemarks_to_remove = set()
-        removed_duplicates_report = []
-        for placemark in root.findall('.//{http://www.opengis.net/kml/2.2}Placemark'):
-            placemark_name = get_name(placemark)
-            for geom_type in ['Polygon', 'LineString', 'MultiGeometry', 'LinearRing', 'Point']:
-                geometry = find_first_child_by_tag(placemark, geom_type)
-                if geometry is not None:
-                    coords_elem = find_first_child_by_tag(geometry, 'coordinates')
-                    if coords_elem is not None:
-                        coords = coords_elem.text.strip()
-                        norm_coords = normalize_coords(coords)
-                        norm_key = (placemark_name, geom_type, norm_coords)
+        self.duplicates_by_folder = collections.Counter()
+        if self.use_cache:
+            self._open_cache()
+        try:
+            removed_count = self._remove_duplicates()
+        finally:
+            if self._cache is not None:
+                print(f"Fingerprint cache: {self._cache.hits} hits, {self._cache.misses} misses")
+                self._cache.close()
+                self._cache = None
+        print(f"Total duplicates removed: {removed_count}")
+        # Do NOT update self.polygons here to avoid reintroducing duplicates
+        print("========== END OF DEDUPLICATION ==========")
+        self.duplicates_removed = removed_count
+        return removed_count
+
+    def _remove_duplicates(self):
+        if self.streaming:
+            removed_count = self._remove_duplicates_streaming()
+        else:
+            root = self.tree.getroot()
+            # (placemark, folder path) pairs from one top-down pass
+            placemarks = list(iter_placemark_paths(root))
+            with io.StringIO() as report_entries:
+                if self.workers and self.workers > 1:
+                    to_remove = self._find_duplicates_parallel(report_entries, total=len(placemarks))
+                else:
+                    to_remove = self._find_duplicates(placemarks, report_entries, total=len(placemarks))
+                # Remove all but the last occurrence of each unique geometry
+                removed_count = 0
+                with self.profiler.stage('node_removal') as counts:
+                    for index in to_remove:
+                        placemark = placemarks[index][0]
                         parent = placemark.getparent()
-                        parent_folder = None
-                        while parent is not None:
-                            if parent.tag.endswith('Folder'):
-                                folder_name_elem = parent.find('{http://www.opengis.net/kml/2.2}name') or parent.find('name')
-                                if folder_name_elem is not None and folder_name_elem.text:
-                                    parent_folder = folder_name_elem.text.strip()
-                                    break
-                            parent = parent.getparent()
-                        # Mark previous occurrence for removal (generic logic for all names and types)
-                        if norm_key in last_occurrence:
-                            placemarks_to_remove.add(last_occurrence[norm_key])
-                            removed_duplicates_report.append({
-                                'name': placemark_name,
-                                'geometry_type': geom_type,
-                                'parent_folder': parent_folder,
-                                'raw_coords': coords,
-                                'norm_coords': norm_coords
-                            })
-                        last_occurrence[norm_key] = placemark
-        # Remove all but the last occurrence of each unique geometry
-        removed_count = 0
-        for placemark in placemarks_to_remove:
-            parent = placemark.getparent()
-            if parent is not None:
-                parent.remove(placemark)
-                removed_count += 1
+                        if parent is not None:
+                            parent.remove(placemark)
+                            removed_count += 1
+                    counts['removed'] = removed_count
+                if removed_count:
+                    self._document_changed()
+                self._write_duplicates_report(removed_count, report_entries)
+        return removed_count
+
+    def _open_cache(self):
+        from utils.fingerprint_cache import DEFAULT_MAX_ENTRIES, FingerprintCache
+
+        self._cache = FingerprintCache(self.cache_path, self.cache_size or DEFAULT_MAX_ENTRIES)
+
+    def clear_cache(self):
+        """
+        Invalidate the persistent fingerprint cache.
+        """
+        from utils.fingerprint_cache import FingerprintCache
+
+        cache = FingerprintCache(self.cache_path)
+        cache.invalidate()
+        cache.close()
+
+    def _remove_duplicates_streaming(self):
+        """
+        Two-pass dedup that never holds the whole document: this first pass streams the KML
+        out of the archive to build the fingerprint index and the set of placemark positions
+        to drop; the second pass happens when the outputs are written without them.
+        """
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as report_entries:
+            if self.workers and self.workers > 1:
+                to_remove = self._find_duplicates_parallel(report_entries)
+            else:
+                to_remove = self._find_duplicates_streamed(report_entries)
+            to_remove -= self._dropped_placemarks
+            self._dropped_placemarks |= to_remove
+            if to_remove:
+                self._document_changed()
+            self._write_duplicates_report(len(to_remove), report_entries)
+        return len(to_remove)
+
+    def _iter_current_placemarks(self):
+        """
+        Yield (position, placemark, folder_path) for every Placemark still in the document,
+        streamed out of the archive (skipping removed positions) in streaming mode.
+        """
+        if self.streaming:
+            if self._folder_names is None:
+                self._read_folder_names()
+            with self.archive.open(self.kml_name) as kml:
+                for index, (placemark, folder_path) in enumerate(iter_placemarks(kml, self._folder_names)):
+                    if index not in self._dropped_placemarks:
+                        yield index, placemark, folder_path
+        else:
+            for index, (placemark, folder_path) in enumerate(iter_placemark_paths(self.tree.getroot())):
+                yield index, placemark, folder_path
+
+    def remove_near_duplicates(self, tolerance_m=1.0, same_name=True):
+        """
+        Optional pass after remove_duplicates: remove Polygon and LineString placemarks that are
+        near-duplicates of a later placemark, i.e. re-digitized copies whose vertices are shifted by
+        at most tolerance_m meters (Hausdorff distance), start at another vertex or run the other way.
+        Candidates come from an STR-tree over the bounding boxes; see utils/near_duplicates.py.
+        With same_name (default) only placemarks with the same name are compared.
+        Keeps the last occurrence, like remove_duplicates: a placemark is removed only when a later
+        near-duplicate of it is kept, and the report names that kept placemark.
+        """
+        from utils.near_duplicates import find_near_duplicates, placemark_geometry
+
+        print(f"\n========== NEAR-DUPLICATE DETECTION (TOLERANCE {tolerance_m} m) ==========")
+        candidates = []
+        folders = []
+        targets = []  # what to drop per candidate: the element, or its position when streaming
+        to_remove = {}
+        with self.profiler.stage('near_duplicates') as counts:
+            for scanned, (index, placemark, folder_path) in enumerate(self._iter_current_placemarks()):
+                if scanned % PROGRESS_EVERY == 0:
+                    self._check_cancelled()
+                    self._report_progress('Removing near-duplicates', scanned)
+                geom_type, geometry = placemark_geometry(placemark)
+                if geometry is not None:
+                    candidates.append((index, get_name(placemark), geom_type, geometry))
+                    folders.append(folder_path[-1] if folder_path else None)
+                    targets.append(index if self.streaming else placemark)
+            partners = {}  # earlier candidate -> [(later candidate, distance), ...]
+            for earlier, later, distance in find_near_duplicates(candidates, tolerance_m, same_name):
+                partners.setdefault(earlier, []).append((later, distance))
+            # Walk from the last placemark backwards, so whether every later partner is kept is
+            # known: a placemark is only removed for the closest near-duplicate that stays, and a
+            # chain of copies is not removed down to one far from the copy that survives
+            for earlier in sorted(partners, reverse=True):
+                kept = [(distance, later) for later, distance in partners[earlier] if later not in to_remove]
+                if kept:
+                    distance, later = min(kept)
+                    to_remove[earlier] = (later, distance)
+            counts['candidates'] = len(candidates)
+            counts['duplicates'] = len(to_remove)
+        with io.StringIO() as report_entries:
+            for earlier, (later, distance) in sorted(to_remove.items()):
+                _, name, geom_type, _ = candidates[earlier]
+                report_entries.write(f"Name: {name}\n")
+                report_entries.write(f"Geometry Type: {geom_type}\n")
+                report_entries.write(f"Parent Folder: {folders[earlier]}\n")
+                report_entries.write(f"Kept: {candidates[later][1]} (Parent Folder: {folders[later]})\n")
+                report_entries.write(f"Hausdorff Distance (m): {distance:.3f}\n")
+                report_entries.write("---\n")
+            if self.streaming:
+                self._dropped_placemarks.update(targets[earlier] for earlier in to_remove)
+                if to_remove:
+                    self._document_changed()
+            else:
+                with self.profiler.stage('node_removal') as counts:
+                    for earlier in to_remove:
+                        placemark = targets[earlier]
+                        placemark.getparent().remove(placemark)
+                    counts['removed'] = len(to_remove)
+                if to_remove:
+                    self._document_changed()
+            self._write_duplicates_report(len(to_remove), report_entries, near=True)
+        print(f"Total near-duplicates removed: {len(to_remove)}")
+        print("========== END OF NEAR-DUPLICATE DETECTION ==========")
+        return len(to_remove)
+
+    def simplify_geometries(self, precision=None, tolerance_m=None):
+        """
+        Optional pass after the deduplication passes: rewrite every <coordinates> block with the
+        values rounded to precision decimals, the altitude dropped where it is constant and
+        ignored (clamped to the ground), and the vertices simplified with Douglas-Peucker at
+        tolerance_m meters when it is given (see utils/simplify.py).
+        In streaming mode the rewrite happens while the outputs are written, and the vertex
+        counts come from a separate pass over the remaining placemarks.
+        Returns (vertices before, vertices after).
+        """
+        from utils.simplify import simplify_blocks
+
+        print(f"\n========== COORDINATE SIMPLIFICATION (PRECISION {precision}, TOLERANCE {tolerance_m} m) ==========")
+        self._simplify = (precision, tolerance_m)
+        vertices_before = vertices_after = 0
+        with self.profiler.stage('simplify') as counts:
+            if self.streaming:
+                # Streamed placemarks are freed as the scan moves on, so only their text is kept
+                elements = (coords for _, placemark, _ in self._iter_current_placemarks()
+                            for coords in placemark.iter(COORDINATES_TAG))
+            else:
+                elements = self.tree.getroot().iter(COORDINATES_TAG)
+            blocks = ((coords, self._coordinate_block(coords)) for coords in elements if coords.text)
+            scanned = 0
+            # Blocks are simplified SIMPLIFY_BATCH at a time so NumPy works on large arrays
+            for batch in iter(lambda: list(itertools.islice(blocks, SIMPLIFY_BATCH)), []):
+                self._check_cancelled()
+                self._report_progress('Simplifying geometries', scanned)
+                results = simplify_blocks([block for _, block in batch], precision, tolerance_m)
+                for (coords, _), (text, before, after) in zip(batch, results):
+                    if not self.streaming:
+                        coords.text = text
+                    vertices_before += before
+                    vertices_after += after
+                scanned += len(batch)
+            counts['coordinates'] = scanned
+            counts['vertices_before'] = vertices_before
+            counts['vertices_after'] = vertices_after
+        self._document_changed()
+        print(f"Vertices: {vertices_before} -> {vertices_after}")
+        print("========== END OF COORDINATE SIMPLIFICATION ==========")
+        return vertices_before, vertices_after
+
+    @staticmethod
+    def _coordinate_block(coords):
+        from utils.simplify import altitude_clamped
+
+        return coords.text, coords.getparent().tag.endswith('LinearRing'), altitude_clamped(coords)
+
+    def _simplify_element(self, coords):
+        # Streaming counterpart of simplify_geometries for one <coordinates> element being written
+        from utils.simplify import simplify_blocks
+
+        if coords.text:
+            coords.text = simplify_blocks([self._coordinate_block(coords)], *self._simplify)[0][0]
+
+    def _find_duplicates(self, placemarks, report_entries, total=None):
+        """
+        Scan (placemark, folder_path) pairs in document order and return the positions of
+        the placemarks to remove, keeping the last occurrence of each
+        (name, geometry type, normalized coords) key. Report entries for the duplicates
+        are written to report_entries. total is the number of placemarks, if known, for
+        progress reporting.
+        """
+        # Track the position of the last occurrence of each key, by fingerprint; streaming
+        # mode keeps only the digests so the index stays compact
+        with self.profiler.stage('dedup_scan') as counts:
+            placemarks_to_remove = self._scan_duplicates(placemarks, report_entries, total, counts)
+        return placemarks_to_remove
+
+    def _find_duplicates_streamed(self, report_entries):
+        """
+        Streaming counterpart of _find_duplicates over the placemarks streamed out of the archive.
+        A Folder named after some of its placemarks stops the scan (see iter_placemarks); the
+        Folder names are then read in a pre-pass and the scan runs again with them, so the report
+        gives the same folder paths as the in-memory scan.
+        """
+        with self.profiler.stage('dedup_scan') as counts:
+            while True:
+                try:
+                    with self.archive.open(self.kml_name) as kml:
+                        placemarks_to_remove = self._scan_duplicates(iter_placemarks(kml, self._folder_names),
+                                                                     report_entries, None, counts)
+                    break
+                except LateFolderName as e:
+                    print(f"Folder '{e}' is named after some of its placemarks, reading the folder names first")
+                    self._read_folder_names()
+                    report_entries.seek(0)
+                    report_entries.truncate()
+                    self.duplicates_by_folder.clear()
+                    if self._cache is not None:
+                        self._cache.hits = self._cache.misses = 0
+            if self._folder_names is None:
+                # No Folder was named late, so the later passes cannot meet one either
+                self._folder_names = {}
+        return placemarks_to_remove
+
+    def _read_folder_names(self):
+        with self.archive.open(self.kml_name) as kml:
+            self._folder_names = read_folder_names(kml)
+
+    def _scan_duplicates(self, placemarks, report_entries, total, counts):
+        from utils.fingerprint import FingerprintIndex, placemark_fingerprints
+
+        fingerprint = placemark_fingerprints if self._cache is None else self._cached_placemark_fingerprints
+        last_occurrence = FingerprintIndex(confirm=not self.streaming)
+        placemarks_to_remove = set()
+        # Folder path of every position; placemarks of one folder share the same tuple
+        folder_paths = []
+        counts['placemarks'] = 0
+        for index, (placemark, folder_path) in enumerate(placemarks):
+            counts['placemarks'] = index + 1
+            folder_paths.append(folder_path)
+            if index % PROGRESS_EVERY == 0:
+                self._check_cancelled()
+                self._report_progress('Removing duplicates', index, total, len(placemarks_to_remove))
+            placemark_name, fingerprints = fingerprint(placemark)
+            for geometry_index, (geom_type, coords, digest, grid_bytes) in enumerate(fingerprints):
+                previous = last_occurrence.add_fingerprint(placemark_name, geom_type, digest, grid_bytes, index)
+                # Mark previous occurrence for removal (generic logic for all names and types)
+                if previous is not None:
+                    if coords is None:
+                        # Cache hit: the raw text is only needed for the report
+                        coords = list(iter_geometry_coords(placemark))[geometry_index][1]
+                    if previous not in placemarks_to_remove:
+                        placemarks_to_remove.add(previous)
+                        self.duplicates_by_folder[format_folder_path(folder_paths[previous])] += 1
+                    self._write_report_entry(report_entries, placemark_name, geom_type, folder_path, coords,
+                                             normalize_coords(coords), folder_paths[previous])
+        self._check_cancelled()
+        self._report_progress('Removing duplicates', total or 0, total, len(placemarks_to_remove))
+        counts['duplicates'] = len(placemarks_to_remove)
+        return placemarks_to_remove
+
+    def _find_duplicates_parallel(self, report_entries, total=None):
+        """
+        Sharded variant of _find_duplicates: worker processes fingerprint the placemarks and the
+        report fields of the duplicates, this process merges them in document order.
+        """
+        from utils.parallel_dedup import find_duplicates_parallel
+
+        def shard_done(scanned):
+            self._check_cancelled()
+            self._report_progress('Removing duplicates', scanned, total)
+
+        with self.profiler.stage('dedup_scan') as counts:
+            result = find_duplicates_parallel(self.archive, self.kml_name, self.workers,
+                                              confirm=not self.streaming, on_progress=shard_done)
+            if result is not None:
+                placemarks_to_remove, entries, removed_paths = result
+                for folder_path in removed_paths.values():
+                    self.duplicates_by_folder[format_folder_path(folder_path)] += 1
+                for entry in entries:
+                    self._write_report_entry(report_entries, *entry)
+                counts['duplicates'] = len(placemarks_to_remove)
+                counts['workers'] = self.workers
+        if result is None:
+            print("The document cannot be split into shards, deduplicating on a single core")
+            if self.streaming:
+                return self._find_duplicates_streamed(report_entries)
+            return self._find_duplicates(iter_placemark_paths(self.tree.getroot()), report_entries, total=total)
+        return placemarks_to_remove
+
+    @staticmethod
+    def _write_report_entry(report_entries, name, geom_type, folder_path, coords, normalized_coords, removed_path):
+        # folder_path is that of the placemark reported, removed_path that of the occurrence removed
+        report_entries.write(f"Name: {name}\n")
+        report_entries.write(f"Geometry Type: {geom_type}\n")
+        report_entries.write(f"Parent Folder: {folder_path[-1] if folder_path else None}\n")
+        report_entries.write(f"Removed From: {format_folder_path(removed_path)}\n")
+        report_entries.write(f"Raw Coordinates: {coords}\n")
+        report_entries.write(f"Normalized Coordinates: {normalized_coords}\n")
+        report_entries.write("---\n")
+
+    def _cached_placemark_fingerprints(self, placemark):
+        """
+        placemark_fingerprints through the fingerprint cache: placemarks whose serialized bytes
+        were seen before are answered from the cache and their raw coords are None.
+        """
+        from utils.fingerprint import placemark_fingerprints
+
+        key = self._cache.key(ET.tostring(placemark, with_tail=False))
+        cached = self._cache.get(key)
+        if cached is not None:
+            name, fingerprints = cached
+            return name, [(geom_type, None, digest, grid_bytes) for geom_type, digest, grid_bytes in fingerprints]
+        name, fingerprints = placemark_fingerprints(placemark)
+        self._cache.put(key, name, [(geom_type, digest, grid_bytes)
+                                    for geom_type, _, digest, grid_bytes in fingerprints])
+        return name, fingerprints
+
+    def _write_duplicates_report(self, removed_count, report_entries, near=False):
         # Write the removed duplicates report to a file in the output directory
-        import datetime
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
         base_name = os.path.splitext(os.path.basename(self.kmz_file))[0]
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        report_filename = f"Report_{base_name}_{timestamp}.txt"
-        report_path = os.path.join(self.output_dir, report_filename)
+        report_filename = f"{'NearDuplicatesReport' if near else 'Report'}_{base_name}_{timestamp}.txt"
+        report_path = self._track_output(os.path.join(self.output_dir, report_filename))
+        if near:
+            self.near_report_path = report_path
+        else:
+            self.report_path = report_path
         input_filename = os.path.basename(self.kmz_file)
         with open(report_path, 'w', encoding='utf-8') as report_file:
-            report_file.write(f"Removed Duplicates Report\n========================\n\n")
+            if near:
+                report_file.write(f"Removed Near-Duplicates Report\n==============================\n\n")
+            else:
+                report_file.write(f"Removed Duplicates Report\n========================\n\n")
             report_file.write(f"Input file: {input_filename}\n")
             report_file.write(f"Generated at: {timestamp}\n\n")
-            report_file.write(f"Total duplicates removed: {removed_count}\n\n")
-            report_file.write("This document lists all placemarks that were removed as duplicates during the deduplication process. For each removed placemark, the following information is provided:\n- Name\n- Geometry Type\n- Parent Folder (if any)\n- Raw Coordinates\n- Normalized Coordinates\n\n---\n")
-            for entry in removed_duplicates_report:
-                report_file.write(f"Name: {entry['name']}\n")
-                report_file.write(f"Geometry Type: {entry['geometry_type']}\n")
-                report_file.write(f"Parent Folder: {entry['parent_folder']}\n")
-                report_file.write(f"Raw Coordinates: {entry['raw_coords']}\n")
-                report_file.write(f"Normalized Coordinates: {entry['norm_coords']}\n")
-                report_file.write("---\n")
-        print(f"Total duplicates removed: {removed_count}")
-        tree.write(os.path.join(self.temp_dir, kml_file), pretty_print=True)
-        # Do NOT update self.polygons here to avoid reintroducing duplicates
-        print("========== END OF DEDUPLICATION ==========")
+            if near:
+                report_file.write(f"Total near-duplicates removed: {removed_count}\n\n")
+                report_file.write("This document lists all placemarks that were removed as near-duplicates of a later placemark. For each removed placemark, the following information is provided:\n- Name\n- Geometry Type\n- Parent Folder (if any)\n- The placemark that was kept\n- Hausdorff Distance to the kept placemark, in meters\n\n---\n")
+            else:
+                report_file.write(f"Total duplicates removed: {removed_count}\n\n")
+                report_file.write("This document lists all placemarks that were removed as duplicates during the deduplication process. For each removed placemark, the following information is provided:\n- Name\n- Geometry Type\n- Parent Folder (if any)\n- Removed From: the folder path of the removed occurrence, e.g. Region/District/Lot\n- Raw Coordinates\n- Normalized Coordinates\n\n")
+                report_file.write("Removed Duplicates by Folder Path\n---------------------------------\n")
+                for folder_path, count in self._folder_counts():
+                    report_file.write(f"{count}\t{folder_path or '(no folder)'}\n")
+                report_file.write("\n---\n")
+            report_entries.seek(0)
+            shutil.copyfileobj(report_entries, report_file)
 
     def remove_pictures(self):
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        tree = ET.parse(os.path.join(self.temp_dir, kml_file))
-        root = tree.getroot()
         namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
         
         # Remove GroundOverlay elements from KML
-        for ground_overlay in root.findall('.//kml:GroundOverlay', namespaces):
-            parent = ground_overlay.getparent()
-            parent.remove(ground_overlay)
-        
-        tree.write(os.path.join(self.temp_dir, kml_file), pretty_print=True)
-        
-        # Remove image files from the temporary directory
-        for root_dir, _, files in os.walk(self.temp_dir):
-            for file in files:
-                if file.endswith(('.jpg', '.png')):
-                    os.remove(os.path.join(root_dir, file))
+        if self.streaming:
+            self._dropped_tags.add(f"{{{namespaces['kml']}}}GroundOverlay")
+            self._document_changed()
+        else:
+            with self.profiler.stage('node_removal') as counts:
+                ground_overlays = self.tree.getroot().findall('.//kml:GroundOverlay', namespaces)
+                for ground_overlay in ground_overlays:
+                    parent = ground_overlay.getparent()
+                    parent.remove(ground_overlay)
+                    self._document_changed()
+                counts['removed'] = len(ground_overlays)
+        # The pictures of the removed overlays are no longer linked, so save_cleaned_kmz leaves them out
 
     def get_output_filename(self, ext):
         """
@@ -184,20 +747,83 @@ class PolygonCleaner:
         return f"{base}_cleaned_{timestamp}{ext}"
 
     def save_cleaned_kmz(self, output_file=None):
+        from utils.assets import collect_references
+
         # Create the output directory if it does not exist
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         if output_file is None:
             output_file = os.path.join(self.output_dir, self.get_output_filename('.kmz'))
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        # Do NOT re-parse and re-add placemarks; just zip the cleaned KML as-is
-        with zipfile.ZipFile(output_file, 'w') as kmz:
-            for foldername, subfolders, filenames in os.walk(self.temp_dir):
-                for filename in filenames:
-                    # Skip image files
-                    if not filename.endswith(('.jpg', '.png')):
-                        file_path = os.path.join(foldername, filename)
-                        kmz.write(file_path, os.path.relpath(file_path, self.temp_dir))
+        self._track_output(output_file)
+        # Do NOT re-parse and re-add placemarks; write the cleaned KML straight into the archive
+        # and copy over the members of the input the cleaned document still links to
+        self._assets = None
+        if self.tree is None:
+            # Streaming: the document is serialized while it is zipped, so both count as 'zip'.
+            # The links are collected from every subtree written; the KML member is written
+            # first, so they are all known before the other members are copied.
+            references = set()
+
+            def kml_data(stream):
+                self._write_streamed_kml(stream, on_write=lambda elem: references.update(collect_references([elem])))
+        else:
+            with self.profiler.stage('assets') as counts:
+                references = collect_references([self.tree.getroot()])
+                counts['references'] = len(references)
+                counts['reachable'] = len(self._reachable_assets(references)[0])
+            if self.incremental:
+                kml_data = self._write_tree
+            else:
+                with self.profiler.stage('serialize') as counts:
+                    kml_data = self.serialize_kml()
+                    counts['bytes'] = len(kml_data)
+
+        with self.profiler.stage('zip') as counts:
+            write_kmz(self.archive, output_file, self.kml_name, kml_data,
+                      keep=lambda name: name in self._reachable_assets(references)[0],
+                      compression=self.compression, compresslevel=self.compresslevel)
+            counts['bytes'] = os.path.getsize(output_file)
+        if callable(kml_data):
+            self._saved_kmz = output_file
+        self._write_assets_report(*self._reachable_assets(references))
+        return output_file
+
+    def _reachable_assets(self, references):
+        # (reachable members, missing links) of the document being saved, computed once
+        from utils.assets import reachable_members
+
+        if self._assets is None:
+            self._assets = reachable_members(self.archive, self.kml_name, references)
+        return self._assets
+
+    def _write_assets_report(self, reachable, missing):
+        # List the members left out of the KMZ, the oversized ones kept and the broken links
+        from utils.assets import OVERSIZED_ASSET_BYTES, asset_summary
+
+        limit = self.oversized_asset_bytes or OVERSIZED_ASSET_BYTES
+        orphaned, oversized = asset_summary(self.archive, self.kml_name, reachable, limit)
+        self.assets_removed = len(orphaned)
+        print(f"Assets: {len(reachable) - 1} kept, {len(orphaned)} orphaned removed "
+              f"({sum(size for _, size in orphaned)} bytes), {len(oversized)} over {limit} bytes")
+        self.assets_report_path = self._track_output(self._sidecar_path('AssetsReport', '.txt'))
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        with open(self.assets_report_path, 'w', encoding='utf-8') as report_file:
+            report_file.write("Assets Report\n=============\n\n")
+            report_file.write(f"Input file: {os.path.basename(self.kmz_file)}\n")
+            report_file.write(f"Generated at: {timestamp}\n\n")
+            report_file.write(f"Members kept: {len(reachable) - 1} (besides {self.kml_name})\n")
+            report_file.write(f"Orphaned members removed: {len(orphaned)}\n")
+            report_file.write(f"Oversized members kept (over {limit} bytes): {len(oversized)}\n")
+            report_file.write(f"Missing links: {len(missing)}\n\n")
+            report_file.write("Orphaned members are not linked from the cleaned document or any document it links to, "
+                              "and are left out of the output KMZ. Sizes are uncompressed, in bytes.\n")
+            for title, members in (("Orphaned Members", orphaned), ("Oversized Members", oversized)):
+                report_file.write(f"\n{title}\n{'-' * len(title)}\n")
+                for name, size in members:
+                    report_file.write(f"{size}\t{name}\n")
+            report_file.write("\nMissing Links\n-------------\n")
+            for path in sorted(missing):
+                report_file.write(f"{path}\n")
 
     def save_kml(self, output_file=None):
         # Create the output directory if it does not exist
@@ -206,123 +832,105 @@ class PolygonCleaner:
         
         if output_file is None:
             output_file = os.path.join(self.output_dir, self.get_output_filename('.kml'))
-        
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        shutil.copy(os.path.join(self.temp_dir, kml_file), output_file)
+        self._track_output(output_file)
+
+        with self.profiler.stage('write_kml') as counts:
+            if self._saved_kmz is not None:
+                # Reuse the document already written into the saved KMZ instead of another pass
+                with zipfile.ZipFile(self._saved_kmz) as kmz, kmz.open(self.kml_name) as src, open(output_file, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            elif self.tree is None:
+                self._write_streamed_kml(output_file)
+            elif self.incremental:
+                self._write_tree(output_file)
+            else:
+                with open(output_file, 'wb') as kml:
+                    kml.write(self.serialize_kml())
+            counts['bytes'] = os.path.getsize(output_file)
+        return output_file
 
     def cleanup(self):
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def get_index(self):
+        """
+        Return the placemark name index of the current document, built once and reused by every
+        search and report until a cleaning pass changes the document.
+        """
+        if self._index is None:
+            self._index = PlacemarkIndex(self.get_root())
+        return self._index
+
+    def find_placemarks_by_names(self, names):
+        """
+        Batch lookup for scripts: return {name: [PlacemarkEntry, ...]} for a list of names,
+        matched case-insensitively against the placemark index.
+        """
+        return self.get_index().lookup_many(names)
 
     def print_coordinates_by_name(self, name):
         """
-        Print all coordinates for placemarks with the given name from the original KML file,
+        Print all coordinates for placemarks with the given name from the in-memory KML tree,
         including the name of their parent folder (if any), with a clear console header/footer.
-        This version is robust to namespaces and prints all found names for debugging.
+        Answers from the placemark index instead of walking the tree.
         """
         print(f"\n========== '{name.upper()}' COORDINATES REPORT ==========" , file=sys.stdout)
-        kml_file = [f for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        tree = ET.parse(os.path.join(self.temp_dir, kml_file))
-        root = tree.getroot()
-        namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
         found = False
-        for placemark in root.findall('.//kml:Placemark', namespaces):
-            name_elem = placemark.find('kml:name', namespaces)
-            if name_elem is None:
-                # Try without namespace
-                name_elem = placemark.find('name')
-            # For debugging: print all found names
-            if name_elem is not None and name_elem.text:
-                debug_name = name_elem.text.strip()
-                if debug_name.upper() == name.upper():
-                    polygon = placemark.find('.//kml:Polygon', namespaces)
-                    if polygon is not None:
-                        coords_elem = polygon.find('.//kml:coordinates', namespaces)
-                        if coords_elem is not None:
-                            # Find parent Folder name if exists
-                            parent = placemark.getparent()
-                            folder_name = None
-                            while parent is not None:
-                                if parent.tag == '{http://www.opengis.net/kml/2.2}Folder' or parent.tag.endswith('Folder'):
-                                    folder_name_elem = parent.find('kml:name', namespaces) or parent.find('name')
-                                    if folder_name_elem is not None and folder_name_elem.text:
-                                        folder_name = folder_name_elem.text.strip()
-                                        break
-                                parent = parent.getparent()
-                            print(f"Placemark: {debug_name}\nFolder: {folder_name}\nCoordinates:\n{coords_elem.text.strip()}\n", file=sys.stdout)
-                            found = True
+        for entry in self.get_index().lookup(name):
+            if entry.geometry_type == 'Polygon' and entry.coordinates is not None:
+                folder_name = entry.folder_path[-1] if entry.folder_path else None
+                print(f"Placemark: {entry.name}\nFolder: {folder_name}\nFolder Path: {format_folder_path(entry.folder_path)}\n"
+                      f"Coordinates:\n{entry.coordinates}\n", file=sys.stdout)
+                found = True
         if not found:
             print("No placemarks found with the specified name.", file=sys.stdout)
         print("========== END OF REPORT ==========" , file=sys.stdout)
 
+    def print_coordinates_by_names(self, names):
+        """
+        Print the coordinates report for every name in names, all answered from the same index.
+        """
+        for name in names:
+            self.print_coordinates_by_name(name)
+
     def find_any_element_by_name(self, name, report_label=None):
         """
         Search for any KML element (Placemark, Folder, Document, etc.) with a <name> equal to the given name.
         Print the element type, its parent (if any), and for Placemarks with any geometry, print coordinates.
-        If report_label is 'BEFORE', use the original extracted KML; if 'AFTER', use the cleaned output KML.
+        The search runs against the in-memory tree, so 'BEFORE' reflects the document as loaded
+        and 'AFTER' the cleaned document once the cleaning passes have run; report_label is only
+        used to label the output. Answers from the placemark index instead of walking the tree.
         """
         print(f"\n========== SEARCH FOR '{name.upper()}' IN ANY ELEMENT ==========" , file=sys.stdout)
-        if report_label == 'AFTER':
-            # Use the cleaned KML file from the output directory
-            output_files = [f for f in os.listdir(self.output_dir) if f.endswith('.kml')]
-            print(f"Output directory: {self.output_dir}", file=sys.stdout)
-            print(f"Cleaned KML files found: {output_files}", file=sys.stdout)
-            if not output_files:
-                print("No cleaned KML file found in output directory.", file=sys.stdout)
-                print("========== END OF SEARCH ==========" , file=sys.stdout)
-                return
-            kml_file = os.path.join(self.output_dir, sorted(output_files)[-1])
-            print(f"Using cleaned KML file for AFTER reporting: {kml_file}", file=sys.stdout)
-        else:
-            # Use the extracted KML file from the temp directory
-            kml_file = [os.path.join(self.temp_dir, f) for f in os.listdir(self.temp_dir) if f.endswith('.kml')][0]
-        tree = ET.parse(kml_file)
-        root = tree.getroot()
         found = False
         # Only print Placemark elements that are direct children of Document or Folder (not deleted or orphaned)
-        for elem in root.iter():
-            if not elem.tag.endswith('Placemark'):
-                continue
-            parent = elem.getparent() if hasattr(elem, 'getparent') else None
-            if parent is None or (not parent.tag.endswith('Document') and not parent.tag.endswith('Folder')):
+        for entry in self.get_index().lookup(name):
+            parent_tag = entry.parent.tag
+            if not parent_tag.endswith('Document') and not parent_tag.endswith('Folder'):
                 continue
-            name_elem = elem.find('{http://www.opengis.net/kml/2.2}name')
-            if name_elem is None:
-                name_elem = elem.find('name')
-            if name_elem is not None and name_elem.text:
-                debug_name = name_elem.text.strip()
-                if debug_name.upper() == name.upper():
-                    found = True
-                    parent_tag = parent.tag if parent is not None else None
-                    match_text = f"MATCH: <{elem.tag}> with name '{debug_name}' (parent: {parent_tag})"
-                    # Print coordinates for any geometry type
-                    for geom_type in ['Polygon', 'LineString', 'MultiGeometry', 'LinearRing', 'Point']:
-                        geometry = None
-                        for child in elem.iter():
-                            if child.tag.endswith(geom_type):
-                                geometry = child
-                                break
-                        if geometry is not None:
-                            coords_elem = None
-                            for child in geometry.iter():
-                                if child.tag.endswith('coordinates'):
-                                    coords_elem = child
-                                    break
-                            if coords_elem is not None:
-                                coords = coords_elem.text.strip()
-                                print(f"{match_text}\nGeometry: {geom_type}\nCoordinates:\n{coords}\n", file=sys.stdout)
-                            else:
-                                print(f"{match_text}\nGeometry: {geom_type}\nNO coordinates found\n", file=sys.stdout)
-                            break
-                    else:
-                        print(match_text, file=sys.stdout)
+            found = True
+            match_text = f"MATCH: <{entry.placemark.tag}> with name '{entry.name}' (parent: {parent_tag})"
+            # Print coordinates for any geometry type
+            if entry.geometry_type is None:
+                print(match_text, file=sys.stdout)
+            elif entry.coordinates is not None:
+                print(f"{match_text}\nGeometry: {entry.geometry_type}\nCoordinates:\n{entry.coordinates}\n", file=sys.stdout)
+            else:
+                print(f"{match_text}\nGeometry: {entry.geometry_type}\nNO coordinates found\n", file=sys.stdout)
         if not found:
             print("No elements found with the specified name.", file=sys.stdout)
         print("========== END OF SEARCH ==========" , file=sys.stdout)
 
     def test_search_and_report(self, name, label='BEFORE'):
+        """
+        Print the search report for one name, or for each name of a list in one call.
+        """
+        names = [name] if isinstance(name, str) else name
         print(f"\n--- {label} DEDUPLICATION ---")
-        self.find_any_element_by_name(name, report_label=label)
+        for each in names:
+            self.find_any_element_by_name(each, report_label=label)
 
 # Example usage
 if __name__ == '__main__':
@@ -0,0 +1,338 @@
+import argparse
+import collections
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.kmz_io import COMPRESSION_METHODS
+
+# Job options accepted over the API: PolygonCleaner arguments and PolygonCleaner.run() arguments
+CLEANER_OPTIONS = ('streaming', 'use_cache', 'compact', 'compression', 'compresslevel', 'incremental',
+                   'folder_report_format', 'oversized_asset_bytes')
+RUN_OPTIONS = ('near_duplicate_tolerance', 'precision', 'simplify_tolerance')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < float('inf')
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+# What the value of every option must be, checked before a job is queued; None means the default
+OPTION_VALUES = {
+    'streaming': (lambda value: isinstance(value, bool), 'true or false'),
+    'use_cache': (lambda value: isinstance(value, bool), 'true or false'),
+    'compact': (lambda value: isinstance(value, bool), 'true or false'),
+    'incremental': (lambda value: isinstance(value, bool), 'true or false'),
+    'compression': (lambda value: isinstance(value, str) and value in COMPRESSION_METHODS, ' or '.join(COMPRESSION_METHODS)),
+    'compresslevel': (lambda value: value is None or _is_count(value) and value <= 9, 'null or 0-9'),
+    'folder_report_format': (lambda value: value in (None, 'json', 'csv'), 'null, json or csv'),
+    'oversized_asset_bytes': (lambda value: value is None or _is_count(value) and value > 0, 'null or a byte count'),
+    'near_duplicate_tolerance': (lambda value: value is None or _is_number(value), 'null or meters'),
+    'precision': (lambda value: value is None or _is_count(value), 'null or a number of decimals'),
+    'simplify_tolerance': (lambda value: value is None or _is_number(value), 'null or meters'),
+}
+# Finished jobs kept for GET /jobs/<id>; older ones are forgotten
+MAX_FINISHED_JOBS = 1000
+SPOOL_POLL_INTERVAL = 1.0
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while max_pending jobs are already queued or running.
+    """
+
+
+class PoolUnavailable(Exception):
+    """
+    Raised when a job cannot be handed to the worker pool, even after replacing a broken one.
+    """
+
+
+def warm_up():
+    # Worker initializer: import everything a job needs once per worker process, not once per job
+    import polygon_cleaner  # noqa: F401
+    import utils.fingerprint  # noqa: F401
+    import utils.kml_stream  # noqa: F401
+
+
+def run_job(kmz_file, output_dir, options):
+    """
+    Clean one KMZ file in a pool worker and return the JSON-serializable job result: the output
+    paths, the counts and the text of the dedup report.
+    """
+    from polygon_cleaner import PolygonCleaner
+
+    start = time.perf_counter()
+    cleaner_options = {key: value for key, value in options.items() if key in CLEANER_OPTIONS}
+    run_options = {key: value for key, value in options.items() if key in RUN_OPTIONS}
+    # Keep the per-stage banners of concurrent jobs out of the service log
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = PolygonCleaner(kmz_file, output_dir=output_dir, **cleaner_options).run(**run_options)
+    result['report_text'] = None
+    if result['report']:
+        with open(result['report'], encoding='utf-8') as report_file:
+            result['report_text'] = report_file.read()
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+class CleanerService:
+    """
+    Long-running cleaner: a pool of `workers` processes that stay alive between jobs, so the
+    interpreter start-up and the lxml/NumPy imports are paid once rather than per file.
+    Every job writes into its own directory, output_dir/<job id>, so concurrent jobs on files
+    with the same name never overwrite each other's outputs.
+    At most max_pending jobs are queued or running at a time; submit() raises QueueFull beyond.
+    A worker that dies (e.g. killed for running out of memory) breaks the whole pool: the jobs it
+    held fail, and the next submit() replaces the pool with a fresh one.
+    """
+
+    def __init__(self, output_dir, workers=None, max_pending=None):
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._jobs = collections.OrderedDict()  # id -> job dict, in submission order
+
+    def submit(self, kmz_file, options=None):
+        """
+        Queue a clean job and return its job dict (id, input, options, status, result, error);
+        status goes from 'pending' to 'done' or 'failed'.
+        """
+        options = options or {}
+        if not isinstance(options, dict):
+            raise ValueError("options must be an object")
+        unknown = set(options) - set(CLEANER_OPTIONS) - set(RUN_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown job options: {', '.join(sorted(unknown))}")
+        for name, value in options.items():
+            is_valid, expected = OPTION_VALUES[name]
+            if not is_valid(value):
+                raise ValueError(f"Invalid value for {name}: {value!r} (expected {expected})")
+        if not os.path.isfile(kmz_file):
+            raise ValueError(f"No such file: {kmz_file}")
+        if not self._pending.acquire(blocking=False):
+            raise QueueFull(f"{self.max_pending} jobs already pending")
+        job = {'id': uuid.uuid4().hex, 'input': kmz_file, 'options': options, 'status': 'pending',
+               'result': None, 'error': None, 'done': threading.Event()}
+        try:
+            future = self._submit_to_pool(run_job, kmz_file, os.path.join(self.output_dir, job['id']), options)
+        except PoolUnavailable:
+            self._pending.release()
+            raise
+        with self._lock:
+            self._jobs[job['id']] = job
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+
+    def _submit_to_pool(self, *args):
+        # Submit to the pool, replacing it once if a dead worker has left it broken
+        pool = self.pool
+        try:
+            return pool.submit(*args)
+        except BrokenProcessPool:
+            pass
+        with self._pool_lock:
+            if self.pool is pool:
+                print("Worker pool is broken, starting a new one")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._new_pool()
+            pool = self.pool
+        try:
+            return pool.submit(*args)
+        except BrokenProcessPool as e:
+            raise PoolUnavailable(f"Worker pool unavailable: {type(e).__name__}: {e}") from e
+
+    def _finish(self, job, future):
+        try:
+            job['result'] = future.result()
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = f"{type(e).__name__}: {e}"
+            job['status'] = 'failed'
+        self._pending.release()
+        job['done'].set()
+        with self._lock:
+            finished = [job_id for job_id, other in self._jobs.items() if other['done'].is_set()]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        job['done'].wait(timeout)
+        return job
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def job_json(job):
+    return {key: value for key, value in job.items() if key != 'done'}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the service:
+        POST /jobs   {"input": "/path/file.kmz", "options": {...}}  -> 202 with the queued job
+        POST /clean  same body, answers once the job is finished      -> 200 with the finished job
+        GET  /jobs/<id>[?wait=<seconds>]                              -> the job, waiting for it if asked
+        GET  /health                                                  -> worker and queue sizes
+    """
+    service = None
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._send(200, {'workers': self.service.workers, 'max_pending': self.service.max_pending})
+        elif url.path.startswith('/jobs/'):
+            job = self.service.get(url.path[len('/jobs/'):])
+            if job is None:
+                self._send(404, {'error': 'Unknown job'})
+                return
+            wait = parse_qs(url.query).get('wait')
+            if wait:
+                try:
+                    seconds = float(wait[0])
+                except ValueError:
+                    seconds = None
+                if seconds is None or not 0 <= seconds < float('inf'):
+                    self._send(400, {'error': f"Bad request: wait must be a number of seconds, not {wait[0]!r}"})
+                    return
+                self.service.wait(job, seconds)
+            self._send(200, job_json(job))
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path not in ('/jobs', '/clean'):
+            self._send(404, {'error': 'Not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            job = self.service.submit(request['input'], request.get('options'))
+        except (QueueFull, PoolUnavailable) as e:
+            self._send(503, {'error': str(e)})
+            return
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {'error': f"Bad request: {e}"})
+            return
+        except Exception as e:
+            self._send(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        if self.path == '/clean':
+            self._send(200, job_json(self.service.wait(job)))
+        else:
+            self._send(202, job_json(job))
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def watch_spool(service, spool_dir, stop_event):
+    """
+    File-drop interface: every .kmz placed in <spool_dir>/incoming is moved to processing/ and
+    cleaned; the job result is written as JSON to done/ (or failed/) next to the moved input.
+    Jobs beyond the queue limit stay in incoming/ until a slot frees up.
+    """
+    folders = {name: os.path.join(spool_dir, name) for name in ('incoming', 'processing', 'done', 'failed')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    def finished(job, name):
+        folder = folders['done'] if job['status'] == 'done' else folders['failed']
+        shutil.move(job['input'], os.path.join(folder, name))
+        with open(os.path.join(folder, f"{os.path.splitext(name)[0]}.json"), 'w', encoding='utf-8') as result_file:
+            json.dump(job_json(job), result_file, indent=2)
+
+    while not stop_event.is_set():
+        for name in sorted(os.listdir(folders['incoming'])):
+            if not name.endswith('.kmz'):
+                continue
+            processing = os.path.join(folders['processing'], name)
+            os.replace(os.path.join(folders['incoming'], name), processing)
+            try:
+                job = service.submit(processing)
+            except QueueFull:
+                os.replace(processing, os.path.join(folders['incoming'], name))
+                break
+            except ValueError as e:
+                print(f"Spool: {name}: {e}")
+                continue
+            except Exception as e:
+                # The job never ran (e.g. the worker pool could not be restarted): record it as failed
+                print(f"Spool: {name}: {e}")
+                finished({'id': None, 'input': processing, 'options': {}, 'status': 'failed', 'result': None,
+                          'error': f"{type(e).__name__}: {e}"}, name)
+                continue
+            threading.Thread(target=lambda job=job, name=name: finished(service.wait(job), name), daemon=True).start()
+        stop_event.wait(SPOOL_POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the cleaner as a long-lived local service.')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the local HTTP API (0 to disable it)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on (local only by default)')
+    parser.add_argument('--spool', type=str, default=None, help='Also clean every .kmz dropped in <SPOOL>/incoming')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of cores)')
+    parser.add_argument('--max-pending', type=int, default=None, help='Maximum queued or running jobs (default: 4 per worker)')
+    parser.add_argument('--output-dir', type=str, default=None, help='Output directory (default: ~/PolygonCleanerOutput)')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(os.path.expanduser('~'), 'PolygonCleanerOutput')
+    service = CleanerService(output_dir, workers=args.workers, max_pending=args.max_pending)
+    # Start a worker now so the first job does not pay for it
+    service.pool.submit(warm_up).result()
+    stop_event = threading.Event()
+    spool = None
+    if args.spool:
+        spool = threading.Thread(target=watch_spool, args=(service, args.spool, stop_event), daemon=True)
+        spool.start()
+        print(f"Watching {os.path.join(args.spool, 'incoming')}")
+    try:
+        if args.port:
+            ServiceHandler.service = service
+            server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+            print(f"Listening on http://{args.host}:{server.server_port} with {service.workers} workers")
+            server.serve_forever()
+        elif spool is not None:
+            spool.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
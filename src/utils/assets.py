@@ -0,0 +1,116 @@
+import html
+import posixpath
+import re
+from urllib.parse import unquote
+
+from lxml import etree as ET
+
+# Elements whose text links to a file: KML links, icons and overlays (href), model textures
+# (targetHref/sourceHref), shared styles and schemas in other files, and COLLADA textures
+LINK_TAGS = ('href', 'targetHref', 'sourceHref', 'styleUrl', 'schemaUrl', 'init_from')
+# Elements holding balloon HTML, which links images with src/href attributes and CSS url()
+HTML_TAGS = ('description', 'text', 'linkDescription')
+# Archive members whose own links are followed
+LINKED_DOCUMENTS = ('.kml', '.dae')
+# Referenced members larger than this are listed as oversized in the assets report
+OVERSIZED_ASSET_BYTES = 1024 * 1024
+
+_REFERENCE_TAGS = tuple(f'{{*}}{tag}' for tag in LINK_TAGS + HTML_TAGS)
+_HTML_REF_RE = re.compile(r'''\b(?:src|href|background)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))|'''
+                          r'''\burl\(\s*["']?([^"')]+)''', re.I)
+# URLs with a scheme (http:, data:, file:, a drive letter) and absolute paths point outside the archive
+_EXTERNAL_RE = re.compile(r'[a-zA-Z][\w+.-]*:|/')
+
+
+def element_references(elem):
+    """
+    Yield the raw link strings found in elem and its descendants, in document order.
+    """
+    for child in elem.iter(*_REFERENCE_TAGS):
+        if not child.text:
+            continue
+        if child.tag.rsplit('}', 1)[-1] in LINK_TAGS:
+            yield child.text
+        else:
+            for match in _HTML_REF_RE.finditer(child.text):
+                yield html.unescape(next(group for group in match.groups() if group is not None))
+
+
+def resolve_reference(reference, base_dir=''):
+    """
+    Return the archive path a link points to, relative to the directory base_dir of the
+    document holding it, or None for external URLs, same-document fragments and paths that
+    leave the archive.
+    """
+    path = reference.strip().split('#', 1)[0].split('?', 1)[0].replace('\\', '/')
+    if not path or _EXTERNAL_RE.match(path):
+        return None
+    path = posixpath.normpath(posixpath.join(base_dir, unquote(path)))
+    if path == '.' or path == '..' or path.startswith('../'):
+        return None
+    return path
+
+
+def collect_references(elements, base_dir=''):
+    """
+    Return the set of archive paths linked from the given elements (and their descendants).
+    """
+    references = set()
+    for elem in elements:
+        for reference in element_references(elem):
+            path = resolve_reference(reference, base_dir)
+            if path is not None:
+                references.add(path)
+    return references
+
+
+def _document_references(archive, name):
+    # Links of a KML or COLLADA member, relative to its own directory
+    try:
+        with archive.open(name) as document:
+            root = ET.parse(document).getroot()
+    except ET.XMLSyntaxError:
+        return set()
+    return collect_references([root], posixpath.dirname(name))
+
+
+def reachable_members(archive, kml_name, references):
+    """
+    Walk the reference graph of the archive from the root document kml_name, whose links are
+    references, into every linked KML and COLLADA member.
+    Returns (reachable member names, links to paths missing from the archive). Links that
+    only differ from a member name by case still reach it, as they do on Windows.
+    """
+    members = {info.filename for info in archive.infolist() if not info.is_dir()}
+    folded = {name.lower(): name for name in members}
+    reachable = {kml_name}
+    missing = set()
+    pending = list(references)
+    while pending:
+        path = pending.pop()
+        member = path if path in members else folded.get(path.lower())
+        if member is None:
+            missing.add(path)
+            continue
+        if member in reachable:
+            continue
+        reachable.add(member)
+        if member.lower().endswith(LINKED_DOCUMENTS):
+            pending.extend(_document_references(archive, member))
+    return reachable, missing
+
+
+def asset_summary(archive, kml_name, reachable, oversized_bytes=OVERSIZED_ASSET_BYTES):
+    """
+    Return (orphaned, oversized) as sorted lists of (member name, size in bytes): the members
+    no document links to, and the linked members larger than oversized_bytes.
+    """
+    orphaned, oversized = [], []
+    for info in archive.infolist():
+        if info.is_dir() or info.filename == kml_name:
+            continue
+        if info.filename not in reachable:
+            orphaned.append((info.filename, info.file_size))
+        elif info.file_size > oversized_bytes:
+            oversized.append((info.filename, info.file_size))
+    return sorted(orphaned), sorted(oversized)
@@ -0,0 +1,126 @@
+import hashlib
+from operator import methodcaller
+
+import numpy as np
+
+from utils.kml_utils import get_name, iter_geometry_coords
+
+# Coordinates are compared on a 1e-6 degree grid (about 11 cm), like normalize_coords
+GRID = 1e6
+
+_count_commas = methodcaller('count', ',')
+
+
+def parse_coords(coords_str):
+    """
+    Parse a KML <coordinates> string into an (n, 2) float array of (lon, lat).
+    Well-formed blocks, where every tuple has the same number of components, are
+    converted in one NumPy call; anything else falls back to the per-tuple rules of
+    normalize_coords (tuples with fewer than two numbers are skipped).
+    """
+    tuples = coords_str.split()
+    if not tuples:
+        return np.empty((0, 2))
+    comma_counts = set(map(_count_commas, tuples))
+    if len(comma_counts) == 1:
+        width = comma_counts.pop() + 1
+        values = coords_str.replace(',', ' ').split()
+        if width >= 2 and len(values) == len(tuples) * width:
+            try:
+                return np.array(values, dtype=np.float64).reshape(-1, width)[:, :2]
+            except ValueError:
+                pass
+    pairs = []
+    for line in tuples:
+        parts = line.split(",")
+        if len(parts) >= 2:
+            try:
+                pairs.append((float(parts[0]), float(parts[1])))
+            except ValueError:
+                continue
+    return np.array(pairs, dtype=np.float64).reshape(-1, 2)
+
+
+def quantize(coords):
+    """
+    Snap an (n, 2) coordinate array to integer multiples of the 1e-6 grid.
+    """
+    return np.rint(coords * GRID).astype(np.int64)
+
+
+def geometry_digest(name, geom_type, grid_coords):
+    """
+    Fixed-size blake2b digest of a (name, geometry type, quantized coords) dedup key.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((name, geom_type)).encode('utf-8'))
+    digest.update(np.ascontiguousarray(grid_coords).tobytes())
+    return digest.digest()
+
+
+def geometry_fingerprint(name, geom_type, coords_str):
+    """
+    Return (digest, quantized coords) of the dedup key of one geometry.
+    """
+    grid_coords = quantize(parse_coords(coords_str))
+    return geometry_digest(name, geom_type, grid_coords), grid_coords
+
+
+def placemark_fingerprints(placemark):
+    """
+    Return the placemark name and a (geom_type, raw coords, digest, quantized coords bytes)
+    tuple for every geometry that goes into its dedup keys.
+    """
+    name = get_name(placemark)
+    fingerprints = []
+    for geom_type, coords in iter_geometry_coords(placemark):
+        digest, grid_coords = geometry_fingerprint(name, geom_type, coords)
+        fingerprints.append((geom_type, coords, digest, grid_coords.tobytes()))
+    return name, fingerprints
+
+
+class FingerprintIndex:
+    """
+    Map of dedup keys to the position of their last occurrence, keyed on a 16-byte
+    digest instead of the full coordinate tuple.
+
+    With confirm=True the quantized coordinates (as bytes) are kept next to each digest and a
+    digest hit only counts as a duplicate when name, geometry type and coordinates all match;
+    a genuine collision is then tracked under the full key. With confirm=False (streaming
+    mode) only the digest is kept and the 128-bit digest is trusted.
+    """
+
+    def __init__(self, confirm=True):
+        self.confirm = confirm
+        self._last = {}
+        self._collisions = {}
+
+    def __len__(self):
+        return len(self._last) + len(self._collisions)
+
+    def add(self, name, geom_type, coords_str, position):
+        """
+        Record position as the latest occurrence of the key and return the position of
+        the previous occurrence, or None if the key is new.
+        """
+        digest, grid_coords = geometry_fingerprint(name, geom_type, coords_str)
+        return self.add_fingerprint(name, geom_type, digest, grid_coords.tobytes(), position)
+
+    def add_fingerprint(self, name, geom_type, digest, grid_bytes, position):
+        """
+        Same as add() for a key whose digest and quantized coordinates (grid_bytes, the bytes of
+        the int64 array; only needed with confirm=True) are already known, e.g. from the
+        persistent fingerprint cache or a dedup worker process.
+        """
+        entry = (position, name, geom_type, grid_bytes) if self.confirm else (position,)
+        previous = self._last.get(digest)
+        if previous is None:
+            self._last[digest] = entry
+            return None
+        if self.confirm and not (previous[1] == name and previous[2] == geom_type and previous[3] == grid_bytes):
+            full_key = (name, geom_type, grid_bytes)
+            previous_position = self._collisions.get(full_key)
+            self._collisions[full_key] = position
+            return previous_position
+        self._last[digest] = entry
+        return previous[0]
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Bump when the fingerprint layout or the dedup key changes so stale entries are never reused
+CACHE_VERSION = b'fingerprint-v1'
+DEFAULT_MAX_ENTRIES = 2_000_000
+# Pending writes are flushed in batches so streaming runs keep a bounded footprint
+FLUSH_EVERY = 10_000
+
+
+def placemark_key(raw_placemark):
+    """
+    Cache key of a placemark: a digest of its serialized bytes, so any edit produces a new key.
+    """
+    return hashlib.blake2b(CACHE_VERSION + raw_placemark, digest_size=16).digest()
+
+
+def _decode(layout, data):
+    # [(geom_type, digest, grid bytes), ...] from a stored row, or None when it is malformed
+    try:
+        layout = json.loads(layout)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(layout, list) or not isinstance(data, bytes):
+        return None
+    fingerprints = []
+    offset = 0
+    for entry in layout:
+        if (not isinstance(entry, list) or len(entry) != 3 or not isinstance(entry[0], str)
+                or not all(isinstance(size, int) and size >= 0 for size in entry[1:]) or entry[2] % 16):
+            return None
+        geom_type, digest_size, grid_size = entry
+        digest = data[offset:offset + digest_size]
+        grid_bytes = data[offset + digest_size:offset + digest_size + grid_size]
+        offset += digest_size + grid_size
+        fingerprints.append((geom_type, digest, grid_bytes))
+    return fingerprints if offset == len(data) else None
+
+
+class FingerprintCache:
+    """
+    On-disk SQLite cache of per-placemark fingerprints shared across runs.
+
+    Each row holds the placemark name and its (geom_type, digest, quantized coords bytes) keys, so
+    placemarks that did not change since a previous run skip coordinate parsing entirely. The
+    keys are stored as plain data, never as pickles, since the file is shared between processes:
+    a JSON layout of [geom_type, digest length, grid length] per geometry and the digests and
+    grids concatenated in one blob. Rows that do not decode to that shape count as misses.
+    Hits and new entries are written back in batches; close() flushes the rest and then evicts
+    the least recently used entries beyond max_entries.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._used = []
+        self._new = []
+        self._now = int(time.time())
+        self._connection = sqlite3.connect(path, timeout=30)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS placemarks (key BLOB PRIMARY KEY, name TEXT, layout TEXT NOT NULL, '
+                'data BLOB NOT NULL, last_used INTEGER NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS placemarks_last_used ON placemarks (last_used)')
+
+    def key(self, raw_placemark):
+        return placemark_key(raw_placemark)
+
+    def get(self, key):
+        """
+        Return (name, [(geom_type, digest, grid bytes), ...]) for a placemark key, or None.
+        """
+        row = self._connection.execute('SELECT name, layout, data FROM placemarks WHERE key = ?', (key,)).fetchone()
+        fingerprints = None if row is None else _decode(row[1], row[2])
+        if fingerprints is None or not (row[0] is None or isinstance(row[0], str)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append((self._now, key))
+        if len(self._used) >= FLUSH_EVERY:
+            self._flush()
+        return row[0], fingerprints
+
+    def put(self, key, name, fingerprints):
+        layout = json.dumps([[geom_type, len(digest), len(grid_bytes)] for geom_type, digest, grid_bytes in fingerprints])
+        data = b''.join(digest + grid_bytes for _, digest, grid_bytes in fingerprints)
+        self._new.append((key, name, layout, data, self._now))
+        if len(self._new) >= FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO placemarks (key, name, layout, data, last_used) VALUES (?, ?, ?, ?, ?)', self._new)
+            self._connection.executemany('UPDATE placemarks SET last_used = ? WHERE key = ?', self._used)
+        self._new.clear()
+        self._used.clear()
+
+    def invalidate(self):
+        """
+        Drop every cached fingerprint.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM placemarks')
+        self._connection.execute('VACUUM')
+        self._used.clear()
+        self._new.clear()
+
+    def close(self):
+        self._flush()
+        with self._connection:
+            # Size-bounded: evict the least recently used entries beyond max_entries
+            count = self._connection.execute('SELECT COUNT(*) FROM placemarks').fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute(
+                    'DELETE FROM placemarks WHERE key IN (SELECT key FROM placemarks ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,))
+        self._connection.close()
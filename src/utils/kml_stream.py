@@ -0,0 +1,314 @@
+import contextlib
+import itertools
+import re
+
+from lxml import etree as ET
+
+from utils.kml_utils import PLACEMARK_TAG, find_name_child
+
+# Elements that are opened and closed around their children while streaming;
+# every other element is handled as one complete subtree and then freed.
+CONTAINER_TAGS = ('kml', 'Document', 'Folder')
+
+_ATTR_ENTITIES = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+_XML_NS = 'http://www.w3.org/XML/1998/namespace'
+_XMLNS_RE = re.compile(rb' xmlns(?::([\w.-]+))?="([^"]*)"')
+
+
+def _is_container(elem, depth):
+    return depth == 0 or elem.tag.split('}')[-1] in CONTAINER_TAGS
+
+
+def _free(elem):
+    # Drop the children of a handled element and every sibling handled before it
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+class LateFolderName(Exception):
+    """
+    Raised by iter_placemarks when a Folder's <name> comes after some of its placemarks, whose
+    folder paths were then incomplete; read the names with read_folder_names and pass them in.
+    """
+
+
+def _folder_name_text(elem, folders):
+    # Stripped text of elem when it is the <name> of the innermost open Folder, else None
+    if folders and elem.getparent() is folders[-1][0] and elem is find_name_child(folders[-1][0]) and elem.text:
+        return elem.text.strip() or None
+    return None
+
+
+def iter_placemarks(source, folder_names=None):
+    """
+    Stream the Placemarks of a KML file in document order.
+    Yields (placemark, folder_path) where folder_path is the tuple of the names of the
+    enclosing named Folders, outermost first (see kml_utils.iter_placemark_paths). Each
+    placemark is freed as soon as the consumer asks for the next one, so memory stays flat
+    regardless of the file size.
+
+    A Folder whose <name> only comes after some of its placemarks raises LateFolderName, unless
+    folder_names ({Folder index in document order: name}, see read_folder_names) is given.
+    """
+    folders = []  # [folder element, folder name, placemarks yielded before it opened] for every open Folder
+    folder_path = ()  # path of the open Folders, rebuilt only when they change
+    folder_count = 0
+    placemark_count = 0
+    depth = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end'), remove_comments=True, remove_pis=True):
+        if event == 'start':
+            depth += 1
+            if elem.tag.endswith('Folder'):
+                name = folder_names.get(folder_count) if folder_names is not None else None
+                folders.append([elem, name, placemark_count])
+                folder_count += 1
+                if name is not None:
+                    folder_path = None
+            continue
+        depth -= 1
+        if folders and folders[-1][0] is elem:
+            folders.pop()
+            folder_path = None
+        else:
+            name = _folder_name_text(elem, folders)
+            if name is not None and folders[-1][1] is None:
+                if folder_names is None and placemark_count > folders[-1][2]:
+                    raise LateFolderName(name)
+                folders[-1][1] = name
+                folder_path = None
+        if elem.tag == PLACEMARK_TAG:
+            if folder_path is None:
+                folder_path = tuple(name for _, name, _ in folders if name is not None)
+            placemark_count += 1
+            yield elem, folder_path
+        parent = elem.getparent()
+        if parent is not None and _is_container(parent, depth - 1):
+            _free(elem)
+
+
+def read_folder_names(source):
+    """
+    Pre-pass for iter_placemarks: return {Folder index in document order: name} for every named
+    Folder of a KML file, streamed and freed like iter_placemarks.
+    """
+    names = {}
+    folders = []  # (folder element, folder index) for every open Folder
+    folder_count = 0
+    depth = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end'), remove_comments=True, remove_pis=True):
+        if event == 'start':
+            depth += 1
+            if elem.tag.endswith('Folder'):
+                folders.append((elem, folder_count))
+                folder_count += 1
+            continue
+        depth -= 1
+        if folders and folders[-1][0] is elem:
+            folders.pop()
+        else:
+            name = _folder_name_text(elem, folders)
+            if name is not None:
+                names.setdefault(folders[-1][1], name)
+        parent = elem.getparent()
+        if parent is not None and _is_container(parent, depth - 1):
+            _free(elem)
+    return names
+
+
+def iter_placemark_elements(source):
+    """
+    Lighter variant of iter_placemarks: yield every Placemark in document order with only
+    Placemark end events reaching Python. The ancestors and their <name> children are kept,
+    so get_folder_path works on the yielded element; handled Placemarks are freed.
+    """
+    for _, elem in ET.iterparse(source, events=('end',), tag=PLACEMARK_TAG, remove_comments=True, remove_pis=True):
+        yield elem
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        previous = elem.getprevious()
+        while previous is not None and previous.tag == PLACEMARK_TAG:
+            parent.remove(previous)
+            previous = elem.getprevious()
+
+
+def _escape(text, entities=None):
+    # Same as xml.sax.saxutils.escape, which is not imported because it pulls in urllib.request
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    for char, entity in (entities or {}).items():
+        text = text.replace(char, entity)
+    return text
+
+
+def _unescape_attribute(value):
+    return value.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&amp;', '&')
+
+
+def _escape_text(text):
+    return _escape(text).encode('utf-8')
+
+
+def _start_tag(elem, parent):
+    # Re-create the start tag with the prefixes used in the source and only the
+    # namespace declarations that elem adds to its parent's scope
+    qname = ET.QName(elem)
+    parts = [f'{elem.prefix}:{qname.localname}' if elem.prefix else qname.localname]
+    for prefix, uri in elem.nsmap.items():
+        if parent is None or parent.nsmap.get(prefix) != uri:
+            attr = f'xmlns:{prefix}' if prefix else 'xmlns'
+            parts.append(f'{attr}="{_escape(uri, _ATTR_ENTITIES)}"')
+    # The xml prefix (xml:lang, xml:id) is bound implicitly and never appears in nsmap
+    prefixes = {_XML_NS: 'xml'}
+    prefixes.update((uri, prefix) for prefix, uri in elem.nsmap.items() if prefix)
+    attributes = []
+    for key, value in elem.attrib.items():
+        attr_qname = ET.QName(key)
+        if attr_qname.namespace:
+            prefix = prefixes.get(attr_qname.namespace)
+            if prefix is None:
+                # A namespace with no prefix in scope: declare one on this tag
+                used = set(prefixes.values()) | set(elem.nsmap)
+                prefix = next(f'ns{i}' for i in itertools.count() if f'ns{i}' not in used)
+                prefixes[attr_qname.namespace] = prefix
+                parts.append(f'xmlns:{prefix}="{_escape(attr_qname.namespace, _ATTR_ENTITIES)}"')
+            key = f'{prefix}:{attr_qname.localname}'
+        attributes.append(f'{key}="{_escape(value, _ATTR_ENTITIES)}"')
+    parts.extend(attributes)
+    return f"<{' '.join(parts)}>".encode('utf-8'), f'</{parts[0]}>'.encode('utf-8')
+
+
+def strip_blank_text(elem):
+    """
+    Drop the whitespace-only text between the elements of the subtree (indentation), keeping the
+    text of leaf elements. KML has no mixed content, so the document means the same without it.
+    """
+    for node in elem.iter():
+        if len(node) and node.text and not node.text.strip():
+            node.text = None
+        if node is not elem and node.tail and not node.tail.strip():
+            node.tail = None
+
+
+def _subtree_bytes(elem, parent):
+    # tostring() re-declares every namespace in scope on the subtree root; drop the
+    # declarations the enclosing container already provides
+    data = ET.tostring(elem, encoding='UTF-8', xml_declaration=False, with_tail=False)
+    if not isinstance(elem.tag, str):
+        return data
+    tag_end = data.index(b'>')
+    in_scope = parent.nsmap
+
+    def strip(match):
+        prefix = match.group(1).decode('utf-8') if match.group(1) else None
+        uri = match.group(2).decode('utf-8')
+        return b'' if in_scope.get(prefix) == _unescape_attribute(uri) else match.group(0)
+
+    return _XMLNS_RE.sub(strip, data[:tag_end]) + data[tag_end:]
+
+
+def rewrite_kml(source, destination, should_drop, compact=False, on_write=None):
+    """
+    Stream source into destination (paths or binary file objects), leaving out every element for which should_drop(elem)
+    returns True. should_drop is called once per completed element, in document order, and
+    on_write(elem), if given, once per subtree written, after its dropped descendants are removed.
+    Containers (kml, Document, Folder) are written around their children and everything
+    else is written as one subtree and then freed, so only the open container chain
+    and the current subtree are ever held in memory.
+    The layout of the source is kept as it is; compact=True leaves out the indentation instead.
+    """
+    output = open(destination, 'wb') if isinstance(destination, str) else contextlib.nullcontext(destination)
+    with output as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        open_containers = []  # (element, end tag) for every open container
+        pending = None  # element whose tail (or, for a just-opened container, text) is still unwritten
+        pending_is_text = False
+        unit_depth = 0  # nesting level inside the subtree currently being collected
+
+        def flush():
+            nonlocal pending
+            if pending is not None:
+                text = pending.text if pending_is_text else pending.tail
+                if text and not (compact and not text.strip()):
+                    out.write(_escape_text(text))
+                pending = None
+
+        for event, elem in ET.iterparse(source, events=('start', 'end', 'comment', 'pi')):
+            if event in ('comment', 'pi'):
+                if unit_depth == 0:
+                    flush()
+                    out.write(ET.tostring(elem, encoding='UTF-8', with_tail=False))
+                    if open_containers:
+                        pending, pending_is_text = elem, False
+                    else:
+                        out.write(b'\n')
+                continue
+            if event == 'start':
+                if unit_depth == 0 and _is_container(elem, len(open_containers)):
+                    flush()
+                    start_tag, end_tag = _start_tag(elem, open_containers[-1][0] if open_containers else None)
+                    out.write(start_tag)
+                    open_containers.append((elem, end_tag))
+                    pending, pending_is_text = elem, True
+                else:
+                    if unit_depth == 0:
+                        flush()
+                    unit_depth += 1
+                continue
+            if unit_depth == 0:
+                # End of an open container
+                flush()
+                out.write(open_containers.pop()[1])
+                _free(elem)
+                pending, pending_is_text = elem, False
+                continue
+            unit_depth -= 1
+            dropped = should_drop(elem)
+            if unit_depth > 0:
+                if dropped:
+                    elem.getparent().remove(elem)
+                continue
+            if not dropped:
+                if on_write is not None:
+                    on_write(elem)
+                if compact:
+                    strip_blank_text(elem)
+                out.write(_subtree_bytes(elem, open_containers[-1][0]))
+                pending, pending_is_text = elem, False
+            _free(elem)
+
+
+def write_tree(tree, destination):
+    """
+    Write an in-memory KML tree into destination (a path or binary file object) piece by piece:
+    the containers (kml, Document, Folder) are written tag by tag and every other element as one
+    serialized subtree, so the whole document never exists as a single byte string.
+    The whitespace of the tree is written as it is; nothing is re-indented.
+    """
+    output = open(destination, 'wb') if isinstance(destination, str) else contextlib.nullcontext(destination)
+    root = tree.getroot()
+    with output as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+
+        def write(elem, parent, depth):
+            if isinstance(elem.tag, str) and _is_container(elem, depth):
+                start_tag, end_tag = _start_tag(elem, parent)
+                out.write(start_tag)
+                if elem.text:
+                    out.write(_escape_text(elem.text))
+                for child in elem:
+                    write(child, elem, depth + 1)
+                out.write(end_tag)
+            else:
+                out.write(_subtree_bytes(elem, parent))
+            if elem.tail and parent is not None:
+                out.write(_escape_text(elem.tail))
+
+        # Comments and processing instructions around the root element
+        for sibling in reversed(list(root.itersiblings(preceding=True))):
+            out.write(ET.tostring(sibling, encoding='UTF-8', with_tail=False) + b'\n')
+        write(root, None, 0)
+        out.write(b'\n')
+        for sibling in root.itersiblings():
+            out.write(ET.tostring(sibling, encoding='UTF-8', with_tail=False) + b'\n')
@@ -0,0 +1,122 @@
+KML_NS = 'http://www.opengis.net/kml/2.2'
+PLACEMARK_TAG = f'{{{KML_NS}}}Placemark'
+COORDINATES_TAG = f'{{{KML_NS}}}coordinates'
+GEOMETRY_TYPES = ['Polygon', 'LineString', 'MultiGeometry', 'LinearRing', 'Point']
+# Rough size of one degree of latitude; tolerances are given in meters and compared in degrees
+METERS_PER_DEGREE = 111320.0
+
+
+def normalize_coords(coords_str):
+    coord_lines = [line.strip() for line in coords_str.strip().split() if line.strip()]
+    norm_coords = []
+    for line in coord_lines:
+        parts = line.split(",")
+        if len(parts) >= 2:
+            try:
+                lon = round(float(parts[0]), 6)
+                lat = round(float(parts[1]), 6)
+                norm_coords.append((lon, lat))
+            except Exception:
+                continue
+    return tuple(norm_coords)
+
+
+def find_name_child(elem):
+    # Direct <name> child, with or without namespace. Walk the children by hand: lxml's
+    # find()/iterchildren(tag) look ahead for the next match, which scans every sibling
+    # of a Folder holding thousands of placemarks.
+    for child in elem:
+        if child.tag == f'{{{KML_NS}}}name' or child.tag == 'name':
+            return child
+    return None
+
+
+def get_name(elem):
+    name_elem = find_name_child(elem)
+    if name_elem is not None and name_elem.text:
+        return name_elem.text.strip()
+    # Try any descendant <name> (with or without namespace)
+    for child in elem.iter():
+        if isinstance(child.tag, str) and child.tag.endswith('name') and child.text:
+            return child.text.strip()
+    return None
+
+
+def find_first_child_by_tag(elem, tag_suffix):
+    # Find first child (any depth) whose tag ends with tag_suffix (e.g., 'Polygon', 'coordinates')
+    for child in elem.iter():
+        if isinstance(child.tag, str) and child.tag.endswith(tag_suffix):
+            return child
+    return None
+
+
+def _folder_name(folder):
+    # Stripped name of a Folder, or None when its <name> is missing or blank
+    name_elem = find_name_child(folder)
+    if name_elem is not None and name_elem.text:
+        return name_elem.text.strip() or None
+    return None
+
+
+def get_folder_path(elem):
+    """
+    Return the names of the named Folders enclosing elem, outermost first. Walks up the
+    ancestors, so prefer iter_placemark_paths when the paths of many placemarks are needed.
+    """
+    path = []
+    parent = elem.getparent()
+    while parent is not None:
+        if parent.tag.endswith('Folder'):
+            name = _folder_name(parent)
+            if name is not None:
+                path.append(name)
+        parent = parent.getparent()
+    return tuple(reversed(path))
+
+
+def iter_placemark_paths(root):
+    """
+    Yield (placemark, folder_path) for every KML Placemark under root in document order, where
+    folder_path is the tuple of the names of the enclosing named Folders, outermost first;
+    its last item is the name of the nearest named Folder, as in get_folder_path.
+
+    One top-down pass: the Folders open at the current placemark are kept on a stack with their
+    paths, so each Folder name is looked up once and placemarks share the path tuple of their
+    folder instead of walking up their ancestors.
+    """
+    stack = []  # (folder, folder path) of the Folders enclosing the current element
+    for elem in root.iter('{*}Folder', PLACEMARK_TAG):
+        # Nearest enclosing Folder; the parent itself unless the element sits in a Document or deeper
+        folder = elem.getparent()
+        while folder is not None and not folder.tag.endswith('Folder'):
+            folder = folder.getparent()
+        while stack and stack[-1][0] is not folder:
+            stack.pop()
+        path = stack[-1][1] if stack else ()
+        if elem.tag == PLACEMARK_TAG:
+            yield elem, path
+        else:
+            name = _folder_name(elem)
+            stack.append((elem, path + (name,) if name is not None else path))
+
+
+def format_folder_path(folder_path):
+    """
+    Folder path as written in the reports, e.g. 'Region/District/Lot'; '' outside any named Folder.
+    """
+    return '/'.join(folder_path)
+
+
+def iter_geometry_coords(placemark):
+    """
+    Yield (geom_type, raw_coords) for every geometry type found in the placemark that carries
+    a <coordinates> block, in GEOMETRY_TYPES order. A Polygon therefore also yields its
+    LinearRing, exactly as the deduplication key has always been built.
+    """
+    for geom_type in GEOMETRY_TYPES:
+        geometry = find_first_child_by_tag(placemark, geom_type)
+        if geometry is not None:
+            coords_elem = find_first_child_by_tag(geometry, 'coordinates')
+            if coords_elem is not None:
+                yield geom_type, coords_elem.text.strip()
+
@@ -0,0 +1,93 @@
+import copy
+import shutil
+import struct
+import zipfile
+
+# Google Earth and My Maps only read stored and deflated KMZ members, so bzip2/lzma are not offered
+COMPRESSION_METHODS = {'stored': zipfile.ZIP_STORED, 'deflated': zipfile.ZIP_DEFLATED}
+
+_MASK_ENCRYPTED = 0x01
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+_ZIP64_EXTRA_ID = 0x0001
+
+
+def find_kml_name(kmz):
+    """
+    Return the archive name of the root KML document: the first .kml member at the top level of the archive.
+    """
+    for name in kmz.namelist():
+        if '/' not in name and name.endswith('.kml'):
+            return name
+    raise ValueError(f"No KML document found in {kmz.filename}")
+
+
+def _strip_zip64_extra(extra):
+    # The ZIP64 extra field of the central directory record is rebuilt by FileHeader when needed
+    stripped = b''
+    while len(extra) >= 4:
+        header_id, size = struct.unpack('<HH', extra[:4])
+        if header_id != _ZIP64_EXTRA_ID:
+            stripped += extra[:4 + size]
+        extra = extra[4 + size:]
+    return stripped
+
+
+def copy_member(source, destination, info):
+    """
+    Copy one member from source into destination (both open ZipFiles).
+    The compressed bytes are copied as they are, without decompressing and recompressing,
+    unless the member is encrypted or needs ZIP64, in which case it is re-encoded.
+    zipfile has no public API for raw copies, so this writes the local header itself and
+    registers the member with the destination the same way ZipFile.write() does.
+    """
+    if info.flag_bits & _MASK_ENCRYPTED or info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT:
+        with source.open(info) as src, destination.open(copy.copy(info), 'w', force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return
+    # Locate the compressed data after the member's local file header
+    source.fp.seek(info.header_offset)
+    local_header = source.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~_MASK_USE_DATA_DESCRIPTOR
+    new_info.extra = _strip_zip64_extra(info.extra)
+    destination.fp.seek(destination.start_dir)
+    new_info.header_offset = destination.fp.tell()
+    destination.fp.write(new_info.FileHeader(zip64=False))
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for member {info.filename}")
+        destination.fp.write(chunk)
+        remaining -= len(chunk)
+    destination.filelist.append(new_info)
+    destination.NameToInfo[new_info.filename] = new_info
+    destination.start_dir = destination.fp.tell()
+    destination._didModify = True
+
+
+def write_kmz(source, output_file, kml_name, kml_data, keep=lambda name: True, compression='deflated',
+              compresslevel=None):
+    """
+    Write a KMZ straight from the source archive. The KML member is kml_data, either bytes or a
+    callable that writes the document into the stream it is given; it is written first, as the
+    root document of a KMZ should be, so keep can depend on what the callable saw. Every other
+    member for which keep(name) is True is then copied over as raw compressed bytes, and
+    directories are dropped.
+    Nothing is extracted to disk. The KML member is written with compression (a key of
+    COMPRESSION_METHODS) at compresslevel (0-9 for deflated, None for zlib's default).
+    """
+    with zipfile.ZipFile(output_file, 'w', COMPRESSION_METHODS[compression], compresslevel=compresslevel) as kmz:
+        if callable(kml_data):
+            # Cleaning only drops content, so the source size bounds the output size
+            force_zip64 = source.getinfo(kml_name).file_size > zipfile.ZIP64_LIMIT
+            with kmz.open(kml_name, 'w', force_zip64=force_zip64) as stream:
+                kml_data(stream)
+        else:
+            kmz.writestr(kml_name, kml_data)
+        for info in source.infolist():
+            if info.filename != kml_name and not info.is_dir() and keep(info.filename):
+                copy_member(source, kmz, info)
@@ -0,0 +1,95 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from utils.fingerprint import parse_coords
+from utils.kml_utils import KML_NS, METERS_PER_DEGREE, find_first_child_by_tag
+
+
+def placemark_geometry(placemark):
+    """
+    Build a shapely geometry for a Polygon (outer ring and holes) or LineString placemark.
+    Returns (geom_type, geometry), or (None, None) for other or degenerate geometries.
+    """
+    if find_first_child_by_tag(placemark, 'MultiGeometry') is not None:
+        return None, None
+    polygon = find_first_child_by_tag(placemark, 'Polygon')
+    if polygon is not None:
+        outer = polygon.find(f'{{{KML_NS}}}outerBoundaryIs//{{{KML_NS}}}coordinates')
+        if outer is None or not outer.text:
+            return None, None
+        shell = parse_coords(outer.text)
+        holes = [parse_coords(inner.text)
+                 for inner in polygon.iterfind(f'{{{KML_NS}}}innerBoundaryIs//{{{KML_NS}}}coordinates')
+                 if inner.text]
+        if len(shell) < 4 or any(len(hole) < 4 for hole in holes):
+            return None, None
+        return 'Polygon', shapely.Polygon(shell, holes)
+    line = find_first_child_by_tag(placemark, 'LineString')
+    if line is not None:
+        coords_elem = find_first_child_by_tag(line, 'coordinates')
+        if coords_elem is None or not coords_elem.text:
+            return None, None
+        coords = parse_coords(coords_elem.text)
+        if len(coords) < 2:
+            return None, None
+        return 'LineString', shapely.LineString(coords)
+    return None, None
+
+
+def _local_meters(geometries, origins):
+    # Project each geometry onto a plane in meters centred on its (lon, lat) origin, where a
+    # degree of longitude is cos(lat) times shorter than a degree of latitude
+    counts = shapely.get_num_coordinates(geometries)
+    origin_x = np.repeat(origins[:, 0], counts)
+    origin_y = np.repeat(origins[:, 1], counts)
+    scale_x = np.cos(np.radians(origin_y)) * METERS_PER_DEGREE
+
+    def project(coords):
+        return np.column_stack(((coords[:, 0] - origin_x) * scale_x, (coords[:, 1] - origin_y) * METERS_PER_DEGREE))
+    return shapely.transform(geometries, project)
+
+
+def find_near_duplicates(candidates, tolerance_m, same_name=True):
+    """
+    Find pairs of near-duplicate geometries among candidates, a list of
+    (position, name, geom_type, geometry) tuples in document order, with lon/lat coordinates.
+
+    An STR-tree over the bounding boxes limits the comparisons to geometries whose boxes lie
+    within the tolerance of each other, so the cost stays close to O(n log n). Candidate pairs
+    of the same geometry type (and, with same_name, the same case-insensitive name) are near
+    duplicates when their Hausdorff distance is at most tolerance_m. Hausdorff distance does not
+    depend on the start vertex or the winding, so re-digitized copies are caught.
+    Each pair is measured on a local plane in meters around the pair, so a degree of longitude
+    counts for cos(latitude) of a degree of latitude.
+
+    Returns a list of (earlier_index, later_index, distance_m) into candidates.
+    """
+    if len(candidates) < 2:
+        return []
+    geometries = np.array([candidate[3] for candidate in candidates], dtype=object)
+    geom_types = np.array([candidate[2] for candidate in candidates], dtype=object)
+    names = np.array([(candidate[1] or '').upper() for candidate in candidates], dtype=object)
+
+    tree = STRtree(geometries)
+    bounds = shapely.bounds(geometries)
+    # The tolerance in degrees of longitude grows towards the poles: pad with the widest one
+    pad_y = tolerance_m / METERS_PER_DEGREE
+    max_lat = np.minimum(np.maximum(np.abs(bounds[:, 1]), np.abs(bounds[:, 3])) + pad_y, 89.9)
+    pad_x = pad_y / np.cos(np.radians(max_lat))
+    search_boxes = shapely.box(bounds[:, 0] - pad_x, bounds[:, 1] - pad_y, bounds[:, 2] + pad_x, bounds[:, 3] + pad_y)
+    earlier, later = tree.query(search_boxes)
+    keep = earlier < later
+    earlier, later = earlier[keep], later[keep]
+    keep = geom_types[earlier] == geom_types[later]
+    if same_name:
+        keep &= names[earlier] == names[later]
+    earlier, later = earlier[keep], later[keep]
+    if not len(earlier):
+        return []
+    centres = (bounds[:, :2] + bounds[:, 2:]) / 2
+    origins = (centres[earlier] + centres[later]) / 2
+    distances = shapely.hausdorff_distance(_local_meters(geometries[earlier], origins),
+                                           _local_meters(geometries[later], origins))
+    close = distances <= tolerance_m
+    return [(int(i), int(j), float(d)) for i, j, d in zip(earlier[close], later[close], distances[close])]
@@ -0,0 +1,249 @@
+import bisect
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.fingerprint import FingerprintIndex, placemark_fingerprints
+from utils.kml_stream import iter_placemark_elements
+from utils.kml_utils import get_folder_path, iter_geometry_coords, normalize_coords
+
+# Byte size of the shards handed to the workers: several per worker so they stay evenly loaded,
+# small enough that a worker never holds much of a huge document at once
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKS_PER_WORKER = 4
+
+_MARKUP = rb'!--.*?-->|!\[CDATA\[.*?\]\]>|\?.*?\?>'
+_TAG_TAIL = rb'(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*?(/?)>'
+# Comments, CDATA sections and processing instructions are matched first so that tags inside
+# them are skipped; the tags that matter for splitting are the containers and Placemark starts.
+# Every alternative shares the leading '<', which keeps the scan over large files fast.
+_TOKEN_RE = re.compile(rb'<(?:' + _MARKUP + rb'|(!DOCTYPE)|(/?)((?:[\w.-]+:)?)(kml|Document|Folder)' + _TAG_TAIL +
+                       rb'|(?:[\w.-]+:)?(Placemark)(?=[\s/>]))', re.S)
+# First child that tells where a Folder's name is: its <name>, a nested feature or the Folder end
+_FOLDER_CHILD_RE = re.compile(
+    rb'<(?:' + _MARKUP + rb'|(/?)((?:[\w.-]+:)?)(name|Folder|Document|Placemark|GroundOverlay|ScreenOverlay|'
+    rb'PhotoOverlay|NetworkLink|Tour)' + _TAG_TAIL + rb')', re.S)
+_NAME_END_RE = re.compile(rb'(?:<!\[CDATA\[.*?\]\]>|<!--.*?-->|[^<])*</(?:[\w.-]+:)?name\s*>', re.S)
+_HEAD_RE = re.compile(rb'(?:\xef\xbb\xbf)?\s*<\?xml.*?\?>', re.S)
+
+
+class UnsplittableDocument(Exception):
+    """
+    The KML cannot be split into shards that parse exactly like the whole document.
+    """
+
+
+def _folder_name(data, pos, prefix):
+    # Raw bytes of the <name> of the Folder whose start tag ends at pos, or None if it has none.
+    # A name that only comes after nested features cannot be placed in a shard's context.
+    for match in _FOLDER_CHILD_RE.finditer(data, pos):
+        closing, tag_prefix, local = match.group(1), match.group(2), match.group(3)
+        if local is None:
+            continue
+        if local == b'name' and not closing and tag_prefix == prefix:
+            if match.group(4):
+                return match.group(0)
+            end = _NAME_END_RE.match(data, match.end())
+            if end is None:
+                raise UnsplittableDocument('unterminated Folder name')
+            return data[match.start():end.end()]
+        if local == b'Folder' and closing:
+            return None
+        raise UnsplittableDocument('Folder name after its features')
+
+
+def _context_tag(data, entry):
+    # Start tag of an open container, followed by its <name> when it is a Folder
+    qualified_name, match, name = entry
+    if match.group(4) != b'Folder':
+        return match.group(0)
+    if name is None:
+        entry[2] = name = _folder_name(data, match.end(), match.group(3)) or b''
+    return match.group(0) + name
+
+
+def split_kml(data, chunk_size):
+    """
+    Cut the raw KML bytes right before Placemark start tags into shards of about chunk_size bytes.
+
+    Returns (head, shards): head is the XML declaration and every shard is
+    (start, end, context, closing, placemarks). context holds the start tags of the containers
+    open at start (kml, Document, Folder), each Folder with its <name>, and closing the end tags
+    of the containers still open at end, so head + context + data[start:end] + closing parses on
+    its own with the same namespaces and parent folders. placemarks is the number of Placemark
+    start tags in the shard.
+    """
+    head_match = _HEAD_RE.match(data)
+    head = head_match.group(0) if head_match else b''
+    stack = []  # [qualified name, start tag, Folder <name> (None until needed)] of every open container
+    shards = []
+    start, context, placemarks = 0, b'', 0
+    next_split = chunk_size
+    for match in _TOKEN_RE.finditer(data):
+        if match.group(1):
+            # A DTD may declare entities that expand to markup
+            raise UnsplittableDocument('DOCTYPE')
+        if match.group(6):
+            if match.start() >= next_split and stack:
+                closing_tags = b''.join(b'</' + entry[0] + b'>' for entry in reversed(stack))
+                shards.append((start, match.start(), context, closing_tags, placemarks))
+                start, placemarks = match.start(), 0
+                context = b''.join(_context_tag(data, entry) for entry in stack)
+                next_split = match.start() + chunk_size
+            placemarks += 1
+            continue
+        local = match.group(4)
+        if local is None:
+            continue
+        closing, prefix, self_closing = match.group(2), match.group(3), match.group(5)
+        if closing:
+            if not stack or stack[-1][0] != prefix + local:
+                raise UnsplittableDocument(f'unbalanced </{(prefix + local).decode()}>')
+            stack.pop()
+        elif not self_closing:
+            stack.append([prefix + local, match, None])
+    shards.append((start, len(data), context, b'', placemarks))
+    return head, shards
+
+
+def _read_shard(kml_path, head, shard):
+    start, end, context, closing, _ = shard
+    with open(kml_path, 'rb') as kml:
+        kml.seek(start)
+        body = kml.read(end - start)
+    # The first shard starts at the top of the file and already holds the declaration
+    return (head + context if start else b'') + body + closing
+
+
+def fingerprint_shard(kml_path, head, shard, confirm=True):
+    """
+    Worker: return (name, [(geom_type, digest, grid bytes or None), ...]) for every placemark of
+    the shard, in document order. The quantized coordinates are only sent back when the parent
+    confirms digest hits (confirm=True).
+    """
+    records = []
+    for placemark in iter_placemark_elements(io.BytesIO(_read_shard(kml_path, head, shard))):
+        name, fingerprints = placemark_fingerprints(placemark)
+        records.append((name, [(geom_type, digest, grid_bytes if confirm else None)
+                               for geom_type, _, digest, grid_bytes in fingerprints]))
+    return records
+
+
+def report_shard(kml_path, head, shard, wanted):
+    """
+    Worker: for the placemarks of the shard the report needs, wanted = {shard position:
+    {geometry index, ...}} (an empty set when only the folder path is needed), return
+    ({shard position: folder_path}, {(shard position, geometry index): (raw coords, normalized coords)}).
+    """
+    paths = {}
+    entries = {}
+    last = max(wanted)
+    for position, placemark in enumerate(iter_placemark_elements(io.BytesIO(_read_shard(kml_path, head, shard)))):
+        if position in wanted:
+            # The shard context holds every enclosing Folder with its name
+            paths[position] = get_folder_path(placemark)
+            for geometry_index, (_, coords) in enumerate(iter_geometry_coords(placemark)):
+                if geometry_index in wanted[position]:
+                    entries[position, geometry_index] = (coords, normalize_coords(coords))
+        if position == last:
+            break
+    return paths, entries
+
+
+def _merge_shards(shards, futures, confirm, on_progress):
+    # Apply the serial "keep the last occurrence" rule to the shard results in document order
+    last_occurrence = FingerprintIndex(confirm=confirm)
+    to_remove = set()
+    # (shard, shard position, geometry index, name, geom_type, removed position) in serial report order
+    duplicates = []
+    shard_starts = []  # position of the first placemark of every shard
+    position = 0
+    for shard_index, (shard, future) in enumerate(zip(shards, futures)):
+        shard_starts.append(position)
+        records = future.result()
+        if len(records) != shard[4]:
+            # Placemarks outside the KML namespace or markup the scan cannot see
+            return None
+        for shard_position, (name, fingerprints) in enumerate(records):
+            for geometry_index, (geom_type, digest, grid_bytes) in enumerate(fingerprints):
+                previous = last_occurrence.add_fingerprint(name, geom_type, digest, grid_bytes,
+                                                           position + shard_position)
+                if previous is not None:
+                    to_remove.add(previous)
+                    duplicates.append((shard_index, shard_position, geometry_index, name, geom_type, previous))
+        position += len(records)
+        if on_progress is not None:
+            on_progress(position)
+    return to_remove, duplicates, shard_starts
+
+
+def find_duplicates_parallel(archive, kml_name, workers, confirm=True, on_progress=None):
+    """
+    Sharded equivalent of the serial dedup scan over the KML member kml_name of archive.
+
+    The KML is extracted to a temporary file and cut into byte ranges right before Placemark
+    start tags (see split_kml). Worker processes parse and fingerprint their ranges; this process
+    merges the fingerprints in document order through a FingerprintIndex, so the "keep the last
+    occurrence" rule picks exactly the placemarks the serial scan picks. A second parallel round
+    collects the report fields of the duplicates only.
+
+    Returns (positions to remove, report entries, {removed position: folder_path}), the report
+    entries being (name, geom_type, folder_path, raw coords, normalized coords, folder_path of the
+    removed occurrence) in serial report order, or None when the document cannot be split safely
+    and the serial scan has to be used.
+    on_progress(placemarks merged so far) is called after every shard.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        kml_path = os.path.join(workdir, 'doc.kml')
+        with archive.open(kml_name) as source, open(kml_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        size = os.path.getsize(kml_path)
+        if not size:
+            return None
+        chunk_size = min(max(size // (workers * CHUNKS_PER_WORKER), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        with open(kml_path, 'rb') as kml, mmap.mmap(kml.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                head, shards = split_kml(data, chunk_size)
+            except UnsplittableDocument:
+                return None
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fingerprint_shard, kml_path, head, shard, confirm) for shard in shards]
+            try:
+                merged = _merge_shards(shards, futures, confirm, on_progress)
+            finally:
+                # Stop queued shards when the merge gives up, fails or is cancelled
+                for future in futures:
+                    future.cancel()
+            if merged is None:
+                return None
+            to_remove, duplicates, shard_starts = merged
+
+            def locate(position):
+                # (shard, shard position) of a document position
+                shard_index = bisect.bisect_right(shard_starts, position) - 1
+                return shard_index, position - shard_starts[shard_index]
+
+            wanted = {}
+            for shard_index, shard_position, geometry_index, _, _, _ in duplicates:
+                wanted.setdefault(shard_index, {}).setdefault(shard_position, set()).add(geometry_index)
+            for position in to_remove:
+                shard_index, shard_position = locate(position)
+                wanted.setdefault(shard_index, {}).setdefault(shard_position, set())
+            report_futures = {shard_index: pool.submit(report_shard, kml_path, head, shards[shard_index], positions)
+                              for shard_index, positions in wanted.items()}
+            report_fields = {shard_index: future.result() for shard_index, future in report_futures.items()}
+
+    def folder_path(position):
+        shard_index, shard_position = locate(position)
+        return report_fields[shard_index][0][shard_position]
+
+    entries = [(name, geom_type, report_fields[shard_index][0][shard_position])
+               + report_fields[shard_index][1][shard_position, geometry_index] + (folder_path(previous),)
+               for shard_index, shard_position, geometry_index, name, geom_type, previous in duplicates]
+    return to_remove, entries, {position: folder_path(position) for position in to_remove}
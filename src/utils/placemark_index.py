@@ -0,0 +1,64 @@
+from collections import defaultdict, namedtuple
+
+from utils.kml_utils import GEOMETRY_TYPES, find_name_child, iter_placemark_paths
+
+# One indexed Placemark. geometry_type is the first of GEOMETRY_TYPES found in the placemark
+# and coordinates the stripped text of the first <coordinates> inside it (None if missing);
+# folder_path holds the names of the enclosing named Folders, outermost first.
+PlacemarkEntry = namedtuple('PlacemarkEntry', ['name', 'placemark', 'parent', 'geometry_type', 'coordinates', 'folder_path'])
+
+
+def _placemark_geometry(placemark):
+    # One walk over the placemark subtree instead of one per geometry type
+    first = {}
+    for child in placemark.iter():
+        if isinstance(child.tag, str):
+            local_name = child.tag.rsplit('}', 1)[-1]
+            if local_name in GEOMETRY_TYPES and local_name not in first:
+                first[local_name] = child
+    for geom_type in GEOMETRY_TYPES:
+        geometry = first.get(geom_type)
+        if geometry is not None:
+            for child in geometry.iter():
+                if isinstance(child.tag, str) and child.tag.endswith('coordinates'):
+                    return geom_type, (child.text or '').strip()
+            return geom_type, None
+    return None, None
+
+
+class PlacemarkIndex:
+    """
+    Case-insensitive name index over the Placemarks of a KML document, built in one top-down
+    pass so every search and report answers in O(1) per name instead of walking the whole tree.
+    Folder paths come from iter_placemark_paths, the same pass the duplicates report uses.
+    """
+
+    def __init__(self, root):
+        self.entries = []
+        self._by_name = defaultdict(list)
+        for placemark, folder_path in iter_placemark_paths(root):
+            self._add(placemark, placemark.getparent(), folder_path)
+
+    def _add(self, placemark, parent, folder_path):
+        name_elem = find_name_child(placemark)
+        if name_elem is None or not name_elem.text:
+            return
+        geom_type, coordinates = _placemark_geometry(placemark)
+        entry = PlacemarkEntry(name_elem.text.strip(), placemark, parent, geom_type, coordinates, folder_path)
+        self.entries.append(entry)
+        self._by_name[entry.name.upper()].append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, name):
+        """
+        Return the entries whose name matches case-insensitively, in document order.
+        """
+        return list(self._by_name.get(name.strip().upper(), ()))
+
+    def lookup_many(self, names):
+        """
+        Batch lookup: return {name: entries} for every name in names.
+        """
+        return {name: self.lookup(name) for name in names}
@@ -0,0 +1,97 @@
+import contextlib
+import csv
+import json
+import sys
+import time
+
+# Stages recorded by PolygonCleaner, in pipeline order
+STAGES = ['extract', 'parse', 'dedup_scan', 'near_duplicates', 'simplify', 'node_removal', 'assets', 'serialize', 'zip', 'write_kml']
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process so far, in MB (None where unsupported).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak memory and element/byte counts for every stage of a run.
+
+    Each `with profiler.stage(name) as counts:` block appends one record to self.records; the
+    block adds its own counts (placemarks, bytes, ...) to the dict it is given. Peak memory is the
+    process peak RSS at the end of the stage, rss_growth_mb how much that peak rose during it.
+    With profile_stage set, that stage also runs under cProfile (across all its occurrences).
+    """
+
+    def __init__(self, profile_stage=None):
+        self.records = []
+        self.profile_stage = profile_stage
+        self.profile = None
+        if profile_stage:
+            import cProfile
+            self.profile = cProfile.Profile()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        counts = {}
+        start_rss = peak_rss_mb()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        profiled = name == self.profile_stage
+        if profiled:
+            self.profile.enable()
+        try:
+            yield counts
+        finally:
+            if profiled:
+                self.profile.disable()
+            end_rss = peak_rss_mb()
+            record = {
+                'stage': name,
+                'wall_s': time.perf_counter() - start_wall,
+                'cpu_s': time.process_time() - start_cpu,
+                'peak_rss_mb': end_rss,
+                'rss_growth_mb': None if end_rss is None else end_rss - start_rss,
+            }
+            record.update(counts)
+            self.records.append(record)
+
+    def totals(self):
+        """
+        Return {stage: {'wall_s', 'cpu_s', 'calls'}} summed over every occurrence of each stage.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+            total['calls'] += 1
+        return totals
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            json.dump({'stages': self.records, 'totals': self.totals()}, metrics_file, indent=2)
+        return path
+
+    def write_csv(self, path):
+        # One row per stage occurrence; the count columns differ per stage and stay empty elsewhere
+        fieldnames = []
+        for record in self.records:
+            fieldnames.extend(key for key in record if key not in fieldnames)
+        with open(path, 'w', encoding='utf-8', newline='') as metrics_file:
+            writer = csv.DictWriter(metrics_file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(self.records)
+        return path
+
+    def dump_profile(self, path):
+        self.profile.dump_stats(path)
+        return path
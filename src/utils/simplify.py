@@ -0,0 +1,152 @@
+import re
+
+import numpy as np
+
+from utils.kml_utils import METERS_PER_DEGREE
+
+# Decimals written when no precision is asked for: about 0.1 micrometer, and few enough that
+# float noise of the last binary digits does not show up (15 significant digits for |lon| < 1000)
+FULL_PRECISION = 12
+# Altitude modes under which Google Earth ignores the altitude of the coordinates
+_CLAMPED_MODES = ('clampToGround', 'clampToSeaFloor')
+# Trailing zeros of the fixed-point numbers, and the decimal point when nothing is left after it
+_TRAILING_ZEROS_RE = re.compile(r'(\.\d*?[1-9])0+\b|\.0+\b')
+
+
+def parse_tuples(coords_str):
+    """
+    Parse a KML <coordinates> string into an (n, width) float array holding every component
+    (lon, lat and altitude when present), or None when the tuples do not all have the same
+    number of components and the block is better left as it is.
+    """
+    tuples = coords_str.split()
+    if not tuples:
+        return None
+    width = tuples[0].count(',') + 1
+    values = coords_str.replace(',', ' ').split()
+    if width < 2 or len(values) != len(tuples) * width or any(t.count(',') != width - 1 for t in tuples):
+        return None
+    try:
+        return np.array(values, dtype=np.float64).reshape(-1, width)
+    except ValueError:
+        return None
+
+
+def douglas_peucker(points, tolerance, starts=None, ends=None):
+    """
+    Return a boolean mask of the vertices of an (n, 2) polyline kept by Douglas-Peucker
+    simplification with the given tolerance (in coordinate units). Several polylines stored one
+    after the other in points are simplified together by passing the index of their first and
+    last vertex in starts and ends.
+
+    All segments of one recursion level are processed together: the distances of every interior
+    vertex to its segment are computed in one NumPy pass and the farthest vertex of each segment
+    splits it when it lies beyond the tolerance, so the Python loop runs once per level rather
+    than once per vertex or per polyline. A closed ring (first vertex == last) starts from the
+    distance to that single vertex, which splits it at its farthest point.
+    """
+    if starts is None:
+        starts, ends = np.array([0]), np.array([len(points) - 1])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = keep[ends] = True
+    while len(starts):
+        interior = ends - starts - 1
+        active = interior > 0
+        starts, ends, interior = starts[active], ends[active], interior[active]
+        if not len(starts):
+            break
+        # Flat index of every interior vertex of every segment, with the segment it belongs to
+        offsets = np.concatenate(([0], np.cumsum(interior)[:-1]))
+        segment = np.repeat(np.arange(len(starts)), interior)
+        index = np.arange(interior.sum()) - offsets[segment] + starts[segment] + 1
+        a, b, p = points[starts[segment]], points[ends[segment]], points[index]
+        ab = b - a
+        ap = p - a
+        length = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0])
+        distance = np.where(length > 0, cross / np.where(length > 0, length, 1), np.hypot(ap[:, 0], ap[:, 1]))
+        farthest = np.maximum.reduceat(distance, offsets)
+        # First vertex reaching its segment's maximum
+        at_max = np.flatnonzero(distance == farthest[segment])
+        _, first = np.unique(segment[at_max], return_index=True)
+        split = farthest > tolerance
+        pivots = index[at_max[first]][split]
+        keep[pivots] = True
+        starts = np.concatenate((starts[split], pivots))
+        ends = np.concatenate((pivots, ends[split]))
+    return keep
+
+
+def _format(coords, precision):
+    row = ','.join([f'%.{precision}f'] * coords.shape[1])
+    text = ' '.join([row % tuple(values) for values in coords.tolist()])
+    return _TRAILING_ZEROS_RE.sub(r'\1', text)
+
+
+def altitude_clamped(coordinates):
+    """
+    True when the geometry holding the <coordinates> element has its altitude ignored: no
+    altitudeMode on the enclosing geometries (the default is clampToGround) or a clamped one.
+    """
+    parent = coordinates.getparent()
+    while parent is not None and not parent.tag.endswith('Placemark'):
+        for child in parent:
+            if isinstance(child.tag, str) and child.tag.endswith('altitudeMode'):
+                return (child.text or '').strip() in _CLAMPED_MODES
+        parent = parent.getparent()
+    return True
+
+
+def simplify_blocks(blocks, precision=None, tolerance_m=None):
+    """
+    Rewrite a batch of KML <coordinates> strings; blocks is a list of
+    (coords_str, ring, drop_altitude) and the result a list of (text, vertices before,
+    vertices after) in the same order.
+
+    precision rounds every component to that many decimals (trailing zeros are left out);
+    drop_altitude removes the altitude when it is the same for every vertex; tolerance_m runs
+    Douglas-Peucker with that tolerance in meters, over the whole batch at once. A ring keeps at
+    least four vertices (three distinct plus the closing one) and is left unsimplified otherwise.
+    Blocks that cannot be parsed uniformly are returned as they are.
+    Raises ValueError for a negative precision.
+    """
+    if precision is not None and precision < 0:
+        raise ValueError(f"precision must be 0 or more, not {precision}")
+    results = [None] * len(blocks)
+    parsed = []  # (block index, coords, changed) of the blocks that can be rewritten
+    for i, (coords_str, ring, drop_altitude) in enumerate(blocks):
+        coords = parse_tuples(coords_str)
+        if coords is None:
+            count = len(coords_str.split())
+            results[i] = (coords_str, count, count)
+            continue
+        changed = precision is not None
+        if drop_altitude and coords.shape[1] == 3 and (coords[:, 2] == coords[0, 2]).all():
+            coords = coords[:, :2]
+            changed = True
+        if precision is not None:
+            coords = np.round(coords, precision)
+        parsed.append((i, coords, changed))
+
+    keeps = {}
+    lines = [(i, coords) for i, coords, _ in parsed if len(coords) > 2]
+    if tolerance_m and lines:
+        sizes = np.array([len(coords) for _, coords in lines])
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        points = np.concatenate([coords[:, :2] for _, coords in lines])
+        keep = douglas_peucker(points, tolerance_m / METERS_PER_DEGREE, starts, starts + sizes - 1)
+        kept = np.add.reduceat(keep, starts)
+        for (i, _), start, size, count in zip(lines, starts, sizes, kept):
+            if count < size and (not blocks[i][1] or count >= 4):
+                keeps[i] = keep[start:start + size]
+
+    for i, coords, changed in parsed:
+        before = len(coords)
+        if i in keeps:
+            coords = coords[keeps[i]]
+        elif not changed:
+            results[i] = (blocks[i][0], before, before)
+            continue
+        results[i] = (_format(coords, FULL_PRECISION if precision is None else precision), before, len(coords))
+    return results
+